@@ -1,7 +1,22 @@
 import datetime
+import os
+import re
 from subprocess import check_output
-from SimpleCV import *
+import numpy
 from crow_config import *
+from crow_frames import open_video
+from crow_cache import FrameCache
+from crow_parallel import process_videos, get_start_times
+from crow_manifest import Manifest
+from crow_events import EventSink
+from crow_store import EventStore
+from crow_gate import MotionGate
+from crow_zones import ZoneSet, get_blob_array, get_zone_blob_sizes
+from crow_tracker import CentroidTracker
+from crow_annotation import Annotation
+from crow_roi import get_roi, get_roi_margin, crop_to_roi
+from crow_metrics import METRICS, start_summary_reporter, start_metrics_server
+from crow_batch import iter_chunks, crop_stack, smooth_stack, frame_diff_masks, get_mask_features, get_mask_image
 
 
 def build_file_list(file_path):
@@ -21,46 +36,49 @@ def split_next_video(file_path, output_path):
 
 def get_bounding_box(image):
     """
-    Get a user-defined bounding box chosen from a given image
+    Get a user-defined bounding box chosen from a given image.
+    The display code is only loaded when a box is actually needed, so headless runs never pull it in
     :param image: Input image that is displayed
     :return: list containing x, y, w,h of the bounding box
     """
+    from get_bounding_box import get_bounding_box as choose_bounding_box
+    return choose_bounding_box(image)
 
-    disp = Display(resolution=image.size())
-    image.drawText(text="Drag a bounding box", x=0, y=0, color=Color.HOTPINK, fontsize=20)
-    image.save(disp)
 
-    up = None
-    down = None
-    bb = None
-
-    while disp.isNotDone():
+def get_detection_roi(image, detection_area, dilates=40, smooth_aperture=(19, 19), roi_margin=None, erodes=3):
+    """
+    Get the region of a frame that feature extraction needs to look at
+    :param image: Full frame; only its size is used
+    :param detection_area: Tuple containing x, y, w, h of the detection area, or None to process the whole frame
+    :param dilates: Number of dilation iterations used for feature extraction
+    :param smooth_aperture: Blob smoothing aperture used for feature extraction
+    :param roi_margin: Pixels kept around the detection area. Defaults to the distance blobs can spread while dilating
+    :param erodes: Number of erosion iterations used for feature extraction
+    :return: Tuple containing x, y, w, h of the region, or None for the whole frame
+    """
+    if detection_area is None:
+        return None
 
-        # Start of bounding box
-        if disp.leftButtonDown:
-            up = None
-            down = disp.leftButtonDownPosition()
+    if roi_margin is None:
+        roi_margin = get_roi_margin(dilates, smooth_aperture, erodes)
 
-        # End of bounding box
-        if disp.leftButtonUp:
-            up = disp.leftButtonUpPosition()
+    return get_roi(detection_area, image.size(), roi_margin)
 
-        # If the box has been defined, draw it
-        if up is not None and down is not None:
-            bb = disp.pointsToBoundingBox(up, down)
-            image.clearLayers()
-            image.drawText(text="Drag again or right click to accept", x=0, y=0, color=Color.HOTPINK, fontsize=20)
-            image.drawRectangle(bb[0], bb[1], bb[2], bb[3])
-            image.save(disp)
 
-        # Exit if the box is accepted
-        if disp.rightButtonDown:
-            if bb is not None:
-                disp.done = True
+def prepare_frame(image, roi=None):
+    """
+    Preprocess a frame for differencing: crop it to the region of interest and smooth out the noise.
+    Every frame is compared twice (as the 'after' and then the 'before' frame), so prepare it once and keep the result.
 
-    disp.quit()
+    :param image: Raw frame
+    :param roi: Tuple containing x, y, w, h of the region to keep, or None for the whole frame
+    :return: Prepared image
+    """
+    with METRICS.time("prepare"):
+        if roi is not None:
+            image = crop_to_roi(image, roi)
 
-    return bb
+        return image.smooth()
 
 
 def get_traffic_features(before_image,
@@ -69,7 +87,10 @@ def get_traffic_features(before_image,
                          erodes=3,
                          dilates=40,
                          smooth_aperture=(19, 19),
-                         blob_min=30):
+                         blob_min=30,
+                         detection_area=None,
+                         roi_margin=None,
+                         morphology="iterative"):
     """
     Find movement features between two video frames.
     Differences between the frames are recognised as movement.
@@ -82,93 +103,312 @@ def get_traffic_features(before_image,
     :param dilates: number of dilation iterations. Fewer dilations = more separate, smaller movements counted
     :param smooth_aperture: Aperture size for combining movement blobs
     :param blob_min: Cutoff for motion size
+    :param detection_area: Only process the region around this x, y, w, h box. Blobs are still reported in full-frame coordinates
+    :param roi_margin: Pixels kept around the detection area. Defaults to the distance blobs can spread while dilating
+    :param morphology: Dilation engine from crow_morphology. All engines give the same result; only the cost differs
     :return: feature set for detected movement
     """
 
-    # Smooth the frames to remove noise, then subtract to find movement
-    detect_image = before_image.smooth() - after_image.smooth()
-
-    # Extract features from the differential by processing the crap out of it
-    # Everything needs to happen in order: Blur, Threshold, Erode, Dialate, Blur, Blob. BTEDBBl!!
-    detect_image = detect_image.threshold(threshold)  # Remove tiny differences in movement
-    detect_image = detect_image.erode(iterations=erodes)  # Cut small movements out
-    detect_image = detect_image.dilate(
-        iterations=dilates)  # Blow up the remaining blobs to combine into large movements
-    detect_image = detect_image.smooth(aperature=smooth_aperture)  # Blur blobs together like a lava lamp
-
-    return detect_image.findBlobs(minsize=blob_min)  # Detect and sort out blobs
-
-
-def find_traffic(images, timestamp=datetime.datetime.now(), output_path="", detection_area=(0,0,0,0), output_images=True, output_log=True):
-    last_image = Image(images[0])
-    last_detections = 0
-    total_detections = 0
-    last_detection_time = timestamp
+    # Crop both frames down to the detection area so the rest of the frame is never processed
+    roi = get_detection_roi(after_image, detection_area, dilates, smooth_aperture, roi_margin, erodes)
+
+    return get_prepared_features(prepare_frame(before_image, roi), prepare_frame(after_image, roi),
+                                 threshold=threshold,
+                                 erodes=erodes,
+                                 dilates=dilates,
+                                 smooth_aperture=smooth_aperture,
+                                 blob_min=blob_min,
+                                 roi=roi,
+                                 morphology=morphology)
+
+
+def get_prepared_features(before_prepared,
+                          after_prepared,
+                          threshold=20,
+                          erodes=3,
+                          dilates=40,
+                          smooth_aperture=(19, 19),
+                          blob_min=30,
+                          roi=None,
+                          morphology="iterative"):
+    """
+    Find movement features between two frames that have already been through prepare_frame.
+    See get_traffic_features for the detection parameters.
 
-    detect_xmin = detection_area[0]
-    detect_xmax = detect_xmin + detection_area[2]
-    detect_ymin = detection_area[1]
-    detect_ymax = detect_ymin + detection_area[3]
+    :param before_prepared: Prepared 'background' frame
+    :param after_prepared: Prepared movement frame
+    :param roi: Region both frames were cropped to, used to map blobs back to full-frame coordinates
+    :return: feature set for detected movement
+    """
 
-    for image in images:
-        num_detections = 0
+    # Subtract the smoothed frames to find movement
+    with METRICS.time("subtract"):
+        detect_image = before_prepared - after_prepared
 
-        next_image = Image(image)
-        features = get_traffic_features(last_image, next_image, threshold=THRESHOLD_MINIMUM,
-                                        erodes=ERODE_ITERATIONS,
-                                        dilates=DILATE_ITERATIONS,
-                                        smooth_aperture=SMOOTHING_APERTURE,
-                                        blob_min=MIN_BLOB_SIZE)
+    # Extract features from the differential by processing the crap out of it
+    # Everything needs to happen in order: Blur, Threshold, Erode, Dialate, Blur, Blob. BTEDBBl!!
+    with METRICS.time("threshold"):
+        detect_image = detect_image.threshold(threshold)  # Remove tiny differences in movement
 
-        # Draw bounding rectangle for detection area
-        next_image.drawRectangle(detection_area[0], detection_area[1], detection_area[2], detection_area[3], color=Color.VIOLET, width=2)
+    return get_mask_features(detect_image, erodes=erodes, dilates=dilates, smooth_aperture=smooth_aperture,
+                             blob_min=blob_min, roi=roi, morphology=morphology)
 
-        if features is not None:
 
-            for blob in features:
+def get_log_line(timestamp, zone=None):
+    """
+    :param timestamp: Time of the detection
+    :param zone: Name of the zone, if there is more than one
+    :return: Line for the traffic log
+    """
+    if zone is None:
+        return "{}\n".format(timestamp.strftime('%H:%M:%S'))
 
-                detection_colour = Color.RED
+    return "{},{}\n".format(timestamp.strftime('%H:%M:%S'), zone)
 
-                # Paint the blob box green if in the detection area
-                if detect_xmin <= blob.x <= detect_xmax:
-                    if detect_ymin <= blob.y <= detect_ymax:
-                        detection_colour = Color.FORESTGREEN
-                        num_detections += 1
 
-                # Draw the blob box and centroid
-                next_image.drawRectangle(blob.x - (blob.width() / 2), blob.y - (blob.height() / 2), blob.width(),
-                                         blob.height(), color=detection_colour, width=3)
-                next_image.drawCircle(ctr=blob.centroid(), rad=10, color=Color.LEGO_ORANGE, thickness=5)
+def open_event_store():
+    """
+    :return: EventStore for EVENT_DATABASE, or None if it is turned off
+    """
+    if not EVENT_DATABASE:
+        return None
 
-        # Only count the detection if there are more in the zone compared to last frame
-        if num_detections > last_detections:
-            time_since_last_detection = timestamp - last_detection_time
-            time_since_last_detection = time_since_last_detection.total_seconds()
+    return EventStore("{0}{1}".format(OUTPUT_FOLDER, EVENT_DATABASE))
 
-            # Cooldown to block repeat detections (centroid tends to bounce)
-            if time_since_last_detection > DETECTION_COOLDOWN:
-                total_detections += 1
-                last_detection_time = timestamp
 
-                # Save motion image
+def iter_frame_features(frames, zones, motion_gate=None):
+    """
+    Run the detector over a sequence of frames, one frame pair at a time
+    :param frames: Iterable of SimpleCV images
+    :param zones: ZoneSet being counted; with DETECTION_ROI only the region around it is processed
+    :param motion_gate: MotionGate that skips the detector on static frame pairs
+    :return: Generator of (frame, feature set or None)
+    """
+    last_prepared = None
+    roi = None
+
+    for next_image in frames:
+        # The first frame only primes the differencer
+        if last_prepared is None:
+            roi = get_detection_roi(next_image, zones.bounding_box() if DETECTION_ROI else None,
+                                    dilates=DILATE_ITERATIONS,
+                                    smooth_aperture=SMOOTHING_APERTURE,
+                                    roi_margin=ROI_MARGIN,
+                                    erodes=ERODE_ITERATIONS)
+
+        # Each frame is only cropped and smoothed once, then carried forward as the next 'before' frame.
+        # Annotations are drawn on the raw frame when it is saved; otherwise it is dropped after this iteration
+        next_prepared = prepare_frame(next_image, roi)
+        if last_prepared is None:
+            last_prepared = next_prepared
+
+        features = None
+        with METRICS.time("gate"):
+            moving = motion_gate is None or motion_gate.has_motion(last_prepared, next_prepared)
+
+        if moving:
+            features = get_prepared_features(last_prepared, next_prepared, threshold=THRESHOLD_MINIMUM,
+                                             erodes=ERODE_ITERATIONS,
+                                             dilates=DILATE_ITERATIONS,
+                                             smooth_aperture=SMOOTHING_APERTURE,
+                                             blob_min=MIN_BLOB_SIZE,
+                                             roi=roi,
+                                             morphology=MORPHOLOGY_ENGINE)
+
+        yield next_image, features
+        last_prepared = next_prepared
+
+
+def iter_batched_features(frames, zones, chunk_size=16):
+    """
+    Run the detector over a sequence of frames a chunk at a time.
+    Smoothing, differencing and thresholding run over the whole chunk at once (see crow_batch); only frames with
+    movement left after the threshold go on to blob extraction.
+    Cached videos are read as grayscale chunks straight from the cache's memory map, with no conversion or copy.
+
+    :param frames: FrameSource, or an iterable of SimpleCV images
+    :param zones: ZoneSet being counted; with DETECTION_ROI only the region around it is processed
+    :param chunk_size: Number of frames per chunk
+    :return: Generator of (frame as a BGR numpy array - grayscale for cached videos -, feature set or None).
+             Frame arrays are reused by later chunks
+    """
+    gray = hasattr(frames, "gray_chunks")
+    if gray:
+        chunks = frames.gray_chunks(chunk_size)
+    else:
+        arrays = frames.arrays() if hasattr(frames, "arrays") else (image.getNumpyCv2() for image in frames)
+        chunks = iter_chunks(arrays, chunk_size)
+
+    last_smoothed = None
+    roi = None
+
+    for chunk in chunks:
+        if last_smoothed is None and DETECTION_ROI:
+            roi_margin = ROI_MARGIN if ROI_MARGIN is not None else get_roi_margin(DILATE_ITERATIONS, SMOOTHING_APERTURE, ERODE_ITERATIONS)
+            roi = get_roi(zones.bounding_box(), (chunk.shape[2], chunk.shape[1]), roi_margin)
+
+        with METRICS.time("prepare"):
+            smoothed = smooth_stack(crop_stack(chunk, roi))
+        with METRICS.time("threshold"):
+            masks = frame_diff_masks(smoothed, last_smoothed, threshold=THRESHOLD_MINIMUM, gray=gray)
+        last_smoothed = smoothed[-1]
+
+        for frame, mask in zip(chunk, masks):
+            features = None
+            if mask.any():
+                features = get_mask_features(get_mask_image(mask), erodes=ERODE_ITERATIONS,
+                                             dilates=DILATE_ITERATIONS,
+                                             smooth_aperture=SMOOTHING_APERTURE,
+                                             blob_min=MIN_BLOB_SIZE,
+                                             roi=roi,
+                                             morphology=MORPHOLOGY_ENGINE)
+
+            yield frame, features
+
+
+def find_traffic(frames, timestamp=datetime.datetime.now(), output_path="", detection_area=(0,0,0,0), output_images=True, output_log=True, warmup_frames=0, event_sink=None, zones=None,
+                 progress=None, progress_interval=1500):
+    """
+    Count traffic through the detection area (or each of a set of zones) over a sequence of frames.
+
+    :param frames: Iterable of SimpleCV images, e.g. a FrameSource from crow_frames. Frames are consumed one at a time,
+                   or a chunk at a time with BATCH_FRAMES
+    :param timestamp: Time of the first frame
+    :param output_path: Prefix for saved motion images
+    :param detection_area: Tuple containing x, y, w, h of the detection area
+    :param output_images: Save an annotated image for each detection
+    :param output_log: Log each detection to the traffic log (and the event database)
+    :param warmup_frames: Number of leading frames that only prime the detector; nothing is counted in them
+    :param event_sink: EventSink that saves images and log lines off the detection loop. One is made for the call if not given
+    :param zones: ZoneSet to count instead of the single detection area
+    :param progress: Called with the number of frames processed every progress_interval frames, once the log is flushed
+    :param progress_interval: Number of frames between progress calls
+    :return: Number of frames processed, list of (timestamp, zone name, blob size, snapshot path) detections
+    """
+    frame_count = 0
+    total_detections = 0
+    detections = []
+
+    # Each zone keeps its own count and cooldown
+    if zones is None:
+        zones = ZoneSet.from_area(detection_area)
+    last_detections = numpy.zeros(len(zones), dtype=int)
+    last_detection_times = [timestamp] * len(zones)
+
+    # Segments (and resumed videos) start part way through the traffic, so the cooldown mustn't block their first
+    # frames. Repeats across a segment boundary are dropped when the segments are merged
+    if warmup_frames:
+        last_detection_times = [timestamp - datetime.timedelta(seconds=DETECTION_COOLDOWN + 1)] * len(zones)
+    log_zones = len(zones) > 1
+
+    # Tracking replaces the rising-count and cooldown rule
+    tracker = None
+    if COUNTING_MODE == "tracker":
+        tracker = CentroidTracker(max_distance=TRACKER_MAX_DISTANCE, max_missed=TRACKER_MAX_MISSED)
+
+    # Static frame pairs are caught by a cheap thumbnail comparison before the full detector runs.
+    # Batches skip static frames after their (already cheap) threshold instead
+    motion_gate = None
+    if BATCH_FRAMES:
+        frame_features = iter_batched_features(frames, zones, chunk_size=BATCH_FRAMES)
+    else:
+        if MOTION_GATE:
+            motion_gate = MotionGate(scale=GATE_SCALE, pixel_threshold=GATE_PIXEL_THRESHOLD, min_changed=GATE_MIN_CHANGED)
+        frame_features = iter_frame_features(frames, zones, motion_gate)
+
+    # Snapshots and log lines are written in the background so the loop never waits on the disk
+    own_sink = event_sink is None
+    if own_sink:
+        event_sink = EventSink(store=open_event_store() if output_log else None)
+
+    try:
+        for next_image, features in frame_features:
+            frame_count += 1
+
+            # Match every blob against every zone in one go
+            blobs = get_blob_array(features)
+            zone_hits = zones.assign(blobs, rule="centre")
+            num_detections = zone_hits.sum(axis=0)
+
+            # Work out which zones picked up new traffic this frame
+            new_detections = []
+
+            if tracker is not None:
+                # Follow blobs between frames and count each one once per zone it enters
+                with METRICS.time("track"):
+                    crossings = tracker.update(blobs, zone_hits)
+
+                if frame_count > warmup_frames:
+                    new_detections = [zone for track, zone in crossings]
+
+            # Only count the detection if there are more in the zone compared to last frame
+            elif frame_count > warmup_frames:
+                for zone in numpy.flatnonzero(num_detections > last_detections):
+                    time_since_last_detection = timestamp - last_detection_times[zone]
+                    time_since_last_detection = time_since_last_detection.total_seconds()
+
+                    # Cooldown to block repeat detections (centroid tends to bounce)
+                    if time_since_last_detection > DETECTION_COOLDOWN:
+                        last_detection_times[zone] = timestamp
+                        new_detections.append(zone)
+
+            if new_detections:
+                blob_sizes = get_zone_blob_sizes(blobs, zone_hits)
+
+                # Save motion image, once per frame however many zones fired. Zones and blobs are only drawn on saved frames
+                snapshot = None
                 if output_images:
-                    next_image.save("{}motion {}.jpg".format(output_path, timestamp.strftime('%Y-%m-%d %H.%M.%S')))
+                    with METRICS.time("events"):
+                        if isinstance(next_image, numpy.ndarray):
+                            from SimpleCV import Image
+                            if next_image.ndim == 2:
+                                next_image = numpy.dstack((next_image, next_image, next_image))  # Cached grayscale frame
+                            else:
+                                next_image = next_image.copy()
+                            next_image = Image(next_image, cv2image=True)
+
+                        snapshot = "{}motion {}.jpg".format(output_path, timestamp.strftime('%Y-%m-%d %H.%M.%S'))
+                        if not event_sink.save_image(next_image, snapshot, annotation=Annotation(zones, blobs, zone_hits)):
+                            snapshot = None
+
+            for zone in new_detections:
+                total_detections += 1
+                detections.append((timestamp, zones.names[zone], int(blob_sizes[zone]), snapshot))
 
                 # Log the event
                 if output_log:
-                    file = open("{0}{1}".format(OUTPUT_FOLDER, LOG_FILENAME), mode='a')
-                    file.write("{}\n".format(timestamp.strftime('%H:%M:%S')))
-                    file.close()
+                    with METRICS.time("events"):
+                        event_sink.log("{0}{1}".format(OUTPUT_FOLDER, LOG_FILENAME),
+                                       get_log_line(timestamp, zones.names[zone] if log_zones else None))
+                        event_sink.record(timestamp, zones.names[zone], CAMERA_NAME, blob_sizes[zone], snapshot)
 
-                print "Detection at: {}".format(timestamp.strftime('%H:%M:%S'))
+                print "Detection at: {}".format(get_log_line(timestamp, zones.names[zone] if log_zones else None).strip())
 
-        timestamp += datetime.timedelta(milliseconds=200)
-        last_image = next_image
-        last_detections = num_detections
+            timestamp += datetime.timedelta(milliseconds=200)
+            last_detections = num_detections
+            METRICS.mark_frame()
 
+            # Checkpoint: everything up to this frame is in the log
+            if progress is not None and frame_count % progress_interval == 0:
+                event_sink.flush()
+                progress(frame_count)
 
-if __name__ == '__main__':
+        if motion_gate is not None:
+            print motion_gate.summary()
+
+    finally:
+        if own_sink:
+            event_sink.close()
+
+    return frame_count, detections
 
+
+def main(detection_area=None):
+    """
+    Count the traffic in every video under VIDEO_PATH, as set up in crow_config
+    :param detection_area: Tuple containing x, y, w, h of the detection area. Defaults to DETECTION_AREA; asked for
+                           on screen if neither is set (and not in DETECTION_ZONES or the manifest)
+    """
     # Find video list and print to confirm numbers/order
     videos = build_file_list(VIDEO_PATH)
     for video in videos:
@@ -177,34 +417,149 @@ if __name__ == '__main__':
 
     start_time = datetime.datetime.strptime(START_TIME, "%Y-%m-%d %H:%M:%S")
 
-    first_video = True
-    bounding_box = None
-
-    for video in videos:
-        split_next_video(video, TEMP_FOLDER)
-
-        # Load up image set
-        image_set = list()
-        directory = os.path.join(TEMP_FOLDER, EXTENSION)
-        image_set = glob.glob(directory)
-
-        if first_video:
-            sample_image = Image(image_set[len(image_set)/2])
-            bounding_box = get_bounding_box(sample_image)
-            print bounding_box
-            first_video = False
-
-        find_traffic(image_set, timestamp=start_time, output_path=OUTPUT_FOLDER, detection_area=bounding_box)
-
-        # Update starting time
-        start_time += datetime.timedelta(seconds=(len(image_set) / FRAME_RATE) - 1)
-
-        # Clear folder
-        for f in image_set:
-            os.remove(f)
-
-
-
-
+    if METRICS_ENABLED:
+        METRICS.enabled = True
+        if METRICS_INTERVAL:
+            start_summary_reporter(METRICS, METRICS_INTERVAL)
+        if METRICS_PORT:
+            start_metrics_server(METRICS, METRICS_PORT)
+
+    decoder_options = {}
+    if FRAME_DECODER == "jpeg":
+        decoder_options = {"temp_folder": TEMP_FOLDER}
+    elif FRAME_DECODER == "cached":
+        decoder_options = {"cache": FrameCache(FRAME_CACHE_FOLDER, FRAME_CACHE_SIZE), "scale": FRAME_CACHE_SCALE}
+
+    # The manifest records how far each video got, so reruns skip finished videos and resume partial ones
+    manifest = Manifest.load(os.path.join(OUTPUT_FOLDER, MANIFEST_FILENAME)) if MANIFEST_FILENAME else None
+
+    # Count the zones from the config, use the detection area passed in (or set in the config), reuse the one from
+    # an earlier run, or pick a single detection area from a frame part way through the first video
+    if detection_area is None:
+        detection_area = DETECTION_AREA
+
+    if DETECTION_ZONES:
+        zones = ZoneSet.load(DETECTION_ZONES)
+        bounding_box = zones.bounding_box()
+    elif detection_area is not None:
+        bounding_box = tuple(detection_area)
+        zones = ZoneSet.from_area(bounding_box)
+    elif manifest is not None and manifest.settings.get("detection_area"):
+        bounding_box = tuple(manifest.settings["detection_area"])
+        zones = ZoneSet.from_area(bounding_box)
+    else:
+        sample_image = open_video(videos[0], decoder=FRAME_DECODER, frame_rate=FRAME_RATE, **decoder_options).sample_frame()
+        bounding_box = get_bounding_box(sample_image)
+        zones = ZoneSet.from_area(bounding_box)
+
+    print bounding_box
+
+    if manifest is not None:
+        manifest.settings["detection_area"] = bounding_box
+        manifest.save()
+
+    if PROCESSES != 1:
+        # Fan the videos (or segments of them) out over a process pool, then merge the detections back in order.
+        # Progress is only recorded per video here; unfinished videos are redone in full
+        start_times = get_start_times(videos, start_time, FRAME_RATE)
+        pending = [index for index, video in enumerate(videos) if manifest is None or not manifest.is_done(video)]
+
+        detections = process_videos([videos[index] for index in pending], start_time, bounding_box,
+                                    output_path=OUTPUT_FOLDER,
+                                    processes=PROCESSES,
+                                    frame_rate=FRAME_RATE,
+                                    segment_seconds=SEGMENT_SECONDS,
+                                    overlap_frames=SEGMENT_OVERLAP_FRAMES,
+                                    cooldown=DETECTION_COOLDOWN if COUNTING_MODE == "cooldown" else 0,
+                                    zones=zones,
+                                    start_times=[start_times[index] for index in pending])
+
+        log_file = open("{0}{1}".format(OUTPUT_FOLDER, LOG_FILENAME), mode='a')
+        for detection, zone, blob_size, snapshot in detections:
+            log_file.write(get_log_line(detection, zone if len(zones) > 1 else None))
+        log_file.close()
+
+        event_store = open_event_store()
+        if event_store is not None:
+            event_store.add((detection, CAMERA_NAME, zone, blob_size, snapshot) for detection, zone, blob_size, snapshot in detections)
+            event_store.close()
+
+        if manifest is not None:
+            for index in pending:
+                video_start, duration = start_times[index]
+                frame_count = int(round(duration * FRAME_RATE))
+                manifest.begin(videos[index], video_start)
+                manifest.finish(videos[index], frame_count,
+                                video_start + datetime.timedelta(seconds=(frame_count / FRAME_RATE) - 1))
+            manifest.save()
+
+        print "{} detections".format(len(detections))
+
+    else:
+        # With a manifest the logs are only written at checkpoints, so a resumed run never logs a detection twice
+        event_sink = EventSink(store=open_event_store(), flush_interval=None if manifest is not None else 5.0)
+
+        try:
+            for video in videos:
+                entry = manifest.lookup(video) if manifest is not None else None
+
+                # Finished on an earlier run - just carry its timestamp on
+                if entry is not None and entry["status"] == "done":
+                    start_time = manifest.get_time(video, "next_start_time")
+                    continue
+
+                # Resume a partial video from its last checkpoint, re-reading the frame before it to prime the detector
+                resume_frame = 0
+                if entry is not None and entry["frames"]:
+                    start_time = manifest.get_time(video, "start_time")
+                    resume_frame = entry["frames"] - 1
+                    print "Resuming {} from frame {}".format(video, entry["frames"])
+                elif manifest is not None:
+                    manifest.begin(video, start_time)
+                    manifest.save()
+
+                # Seek straight to the checkpoint when the decoder can, otherwise decode the skipped frames as warm-up
+                warmup_frames = 1 if resume_frame else 0
+                skipped_frames = resume_frame
+                video_options = dict(decoder_options)
+                if resume_frame and FRAME_DECODER in ("ffmpeg", "cached"):
+                    video_options["start"] = resume_frame / float(FRAME_RATE)
+                else:
+                    warmup_frames += resume_frame
+                    skipped_frames = 0
+
+                frame_source = open_video(video, decoder=FRAME_DECODER, frame_rate=FRAME_RATE, **video_options)
+
+                def save_progress(frames, video=video, skipped_frames=skipped_frames):
+                    manifest.checkpoint(video, skipped_frames + frames)
+                    manifest.save()
+
+                # Frames are streamed straight from the decoder into the detector
+                frame_count, detections = find_traffic(frame_source,
+                                                       timestamp=start_time + datetime.timedelta(seconds=skipped_frames / float(FRAME_RATE)),
+                                                       output_path=OUTPUT_FOLDER,
+                                                       detection_area=bounding_box, event_sink=event_sink,
+                                                       zones=zones,
+                                                       warmup_frames=warmup_frames,
+                                                       progress=save_progress if manifest is not None else None,
+                                                       progress_interval=CHECKPOINT_FRAMES)
+                frame_count += skipped_frames
+
+                # Update starting time
+                next_start_time = start_time + datetime.timedelta(seconds=(frame_count / FRAME_RATE) - 1)
+
+                if manifest is not None:
+                    event_sink.flush()
+                    manifest.finish(video, frame_count, next_start_time)
+                    manifest.save()
+
+                start_time = next_start_time
+
+        finally:
+            # Save anything still queued, including on KeyboardInterrupt. Detections after the last checkpoint are
+            # dropped when there is a manifest; resuming counts them again
+            event_sink.close(flush=manifest is None)
 
 
+if __name__ == '__main__':
+    main()
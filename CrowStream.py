@@ -1,6 +1,20 @@
 import datetime
-from SimpleCV import *
+import numpy
+import sys
 import argparse
+from crow_background import BackgroundModel
+from crow_roi import get_roi, get_roi_margin, crop_to_roi
+from crow_metrics import METRICS, start_summary_reporter, start_metrics_server
+from crow_morphology import MORPHOLOGY_ENGINES
+from crow_capture import CaptureThread, Empty
+from crow_events import EventSink
+from crow_store import EventStore
+from crow_gate import MotionGate
+from crow_zones import ZoneSet, get_blob_array, get_zone_blob_sizes
+from crow_tracker import CentroidTracker
+from crow_annotation import Annotation
+from crow_clips import ClipRecorder
+from crow_batch import crop_stack, smooth_stack, background_diff_masks, get_mask_features, get_mask_image
 
 
 def get_running_average(image_set):
@@ -10,12 +24,7 @@ def get_running_average(image_set):
     :param image_set: Set of images to average
     :return: Single image containing the average of the set
     """
-    total = Image(image_set[0].size())
-
-    for image in image_set:
-        total += image / len(image_set)
-
-    return total
+    return BackgroundModel.from_images(image_set).get_image()
 
 
 def get_weighted_average(image_set):
@@ -26,8 +35,7 @@ def get_weighted_average(image_set):
     :return: Single image containing the weighted average of the set
     """
     if len(image_set):
-        weighted_average = reduce('add', [i /float(len(image_set)) for i in image_set])
-        return  weighted_average
+        return BackgroundModel.from_images(image_set, mode="weighted").get_image()
 
 
 def append_image_to_set(new_image, image_set, max_frames=30):
@@ -51,46 +59,13 @@ def append_image_to_set(new_image, image_set, max_frames=30):
 
 def get_bounding_box(image):
     """
-    Get a user-defined bounding box chosen from a given image
+    Get a user-defined bounding box chosen from a given image.
+    The bounding box GUI is only loaded when a box is actually picked, so runs given an area never import it
     :param image: Input image that is displayed
     :return: list containing x, y, w,h of the bounding box
     """
-
-    disp = Display(resolution=image.size())
-    image.drawText(text="Drag a bounding box", x=0, y=0, color=Color.HOTPINK, fontsize=20)
-    image.save(disp)
-
-    up = None
-    down = None
-    bb = None
-
-    while disp.isNotDone():
-
-        # Start of bounding box
-        if disp.leftButtonDown:
-            up = None
-            down = disp.leftButtonDownPosition()
-
-        # End of bounding box
-        if disp.leftButtonUp:
-            up = disp.leftButtonUpPosition()
-
-        # If the box has been defined, draw it
-        if up is not None and down is not None:
-            bb = disp.pointsToBoundingBox(up, down)
-            image.clearLayers()
-            image.drawText(text="Drag again or right click to accept", x=0, y=0, color=Color.HOTPINK, fontsize=20)
-            image.drawRectangle(bb[0], bb[1], bb[2], bb[3])
-            image.save(disp)
-
-        # Exit if the box is accepted
-        if disp.rightButtonDown:
-            if bb is not None:
-                disp.done = True
-
-    disp.quit()
-
-    return bb
+    from get_bounding_box import get_bounding_box as choose_bounding_box
+    return choose_bounding_box(image)
 
 
 def get_traffic_features(before_image,
@@ -99,7 +74,10 @@ def get_traffic_features(before_image,
                          erodes=3,
                          dilates=40,
                          smooth_aperture=(19, 19),
-                         blob_min=30):
+                         blob_min=30,
+                         detection_area=None,
+                         roi_margin=None,
+                         morphology="iterative"):
     """
     Find movement features between two video frames.
     Differences between the frames are recognised as movement.
@@ -112,21 +90,83 @@ def get_traffic_features(before_image,
     :param dilates: number of dilation iterations. Fewer dilations = more separate, smaller movements counted
     :param smooth_aperture: Aperture size for combining movement blobs
     :param blob_min: Cutoff for motion size
+    :param detection_area: Only process the region around this x, y, w, h box. Blobs are still reported in full-frame coordinates
+    :param roi_margin: Pixels kept around the detection area. Defaults to the distance blobs can spread while dilating
+    :param morphology: Dilation engine from crow_morphology. All engines give the same result; only the cost differs
     :return: feature set for detected movement
     """
 
+    # Crop both frames down to the detection area so the rest of the frame is never processed
+    roi = None
+    if detection_area is not None:
+        if roi_margin is None:
+            roi_margin = get_roi_margin(dilates, smooth_aperture, erodes)
+
+        roi = get_roi(detection_area, after_image.size(), roi_margin)
+        if roi is not None:
+            before_image = crop_to_roi(before_image, roi)
+            after_image = crop_to_roi(after_image, roi)
+
     # Smooth the frames to remove noise, then subtract to find movement
-    detect_image = before_image.smooth() - after_image.smooth()
+    with METRICS.time("prepare"):
+        before_image = before_image.smooth()
+        after_image = after_image.smooth()
+    with METRICS.time("subtract"):
+        detect_image = before_image - after_image
 
     # Extract features from the differential by processing the crap out of it
     # Everything needs to happen in order: Blur, Threshold, Erode, Dialate, Blur, Blob. BTEDBBl!!
-    detect_image = detect_image.threshold(threshold)  # Remove tiny differences in movement
-    detect_image = detect_image.erode(iterations=erodes)  # Cut small movements out
-    detect_image = detect_image.dilate(
-        iterations=dilates)  # Blow up the remaining blobs to combine into large movements
-    detect_image = detect_image.smooth(aperature=smooth_aperture)  # Blur blobs together like a lava lamp
+    with METRICS.time("threshold"):
+        detect_image = detect_image.threshold(threshold)  # Remove tiny differences in movement
+
+    return get_mask_features(detect_image, erodes=erodes, dilates=dilates, smooth_aperture=smooth_aperture,
+                             blob_min=blob_min, roi=roi, morphology=morphology)
+
+
+def get_batch_features(background,
+                       images,
+                       threshold=20,
+                       erodes=3,
+                       dilates=40,
+                       smooth_aperture=(19, 19),
+                       blob_min=30,
+                       detection_area=None,
+                       roi_margin=None,
+                       morphology="iterative"):
+    """
+    Find movement features in several frames against the same background in one go.
+    Smoothing, subtraction and thresholding run over all the frames as one numpy stack (see crow_batch);
+    only frames with movement left after the threshold go on to blob extraction.
+    See get_traffic_features for the detection parameters.
+
+    :param background: Background as a BGR numpy array, e.g. from BackgroundModel.get_array
+    :param images: List of SimpleCV images to compare with the background
+    :return: List with a feature set (or None) for each image
+    """
+    roi = None
+    if detection_area is not None:
+        if roi_margin is None:
+            roi_margin = get_roi_margin(dilates, smooth_aperture, erodes)
+
+        roi = get_roi(detection_area, images[0].size(), roi_margin)
+
+    with METRICS.time("prepare"):
+        smoothed = smooth_stack(crop_stack(numpy.array([image.getNumpyCv2() for image in images]), roi))
+        background_smoothed = smooth_stack(crop_stack(background[numpy.newaxis], roi))[0]
 
-    return detect_image.findBlobs(minsize=blob_min)  # Detect and sort out blobs
+    with METRICS.time("threshold"):
+        masks = background_diff_masks(smoothed, background_smoothed, threshold=threshold)
+
+    feature_sets = []
+    for mask in masks:
+        features = None
+        if mask.any():
+            features = get_mask_features(get_mask_image(mask), erodes=erodes, dilates=dilates,
+                                         smooth_aperture=smooth_aperture, blob_min=blob_min, roi=roi,
+                                         morphology=morphology)
+        feature_sets.append(features)
+
+    return feature_sets
 
 
 def draw_bounding_box(image, bounding_box):
@@ -134,6 +174,8 @@ def draw_bounding_box(image, bounding_box):
     :param bounding_box: Tuple containing x, y, w, h of the bounding box
     :type image: SimpleCV Image object
     """
+    from SimpleCV import Color
+
     image.drawRectangle(bounding_box[0], bounding_box[1], bounding_box[2], bounding_box[3],
                         color=Color.VIOLET, width=2)
 
@@ -158,88 +200,295 @@ def is_blob_in_detection_area(blob, bounding_box):
     return in_detect_area
 
 
-def draw_blob(image, blob, colour=Color.RED):
+def draw_blob(image, blob, colour=None):
+    from SimpleCV import Color
+
+    if colour is None:
+        colour = Color.RED
+
     image.drawRectangle(blob.x - (blob.width() / 2), blob.y - (blob.height() / 2), blob.width(),
                                      blob.height(), color=colour, width=3)
     image.drawCircle(ctr=blob.centroid(), rad=10, color=Color.LEGO_ORANGE, thickness=5)
 
 
-def draw_features(image, feature_set, bounding_box=None):
+def get_zone_hits(feature_set, zones):
+    """
+    Match every blob against every zone in one go, using the same rule as is_blob_in_detection_area
+    :param feature_set: Blobs from get_traffic_features (may be None)
+    :param zones: ZoneSet
+    :return: Boolean numpy array (blobs x zones)
+    """
+    return zones.assign(get_blob_array(feature_set), rule="centroid")
+
+
+def draw_features(image, feature_set, bounding_box=None, zone_hits=None):
+    """
+    Draw the blobs on an image; green if they are in the detection area (or any zone), red if not
+    :param bounding_box: Tuple containing x, y, w, h of the detection area
+    :param zone_hits: Result of get_zone_hits, used instead of the bounding box
+    :return: Number of blobs in the detection area
+    """
+    if zone_hits is None and bounding_box is not None and None not in bounding_box:
+        zone_hits = get_zone_hits(feature_set, ZoneSet.from_area(bounding_box))
+
+    from SimpleCV import Color
+
     num_detections = 0
 
-    if features is not None:
-        for blob in features:
-            detection_colour = Color.RED
+    with METRICS.time("draw"):
+        if feature_set is not None:
+            in_zone = zone_hits.any(axis=1) if zone_hits is not None else [False] * len(feature_set)
 
-            if bounding_box is not None and is_blob_in_detection_area(blob, bounding_box):
+            for blob, detected in zip(feature_set, in_zone):
+                detection_colour = Color.RED
+
+                if detected:
                     num_detections += 1
                     detection_colour = Color.FORESTGREEN
 
-            draw_blob(next_image, blob, colour=detection_colour)
+                draw_blob(image, blob, colour=detection_colour)
 
     return num_detections
 
 
-
-
-
-if __name__ == '__main__':
+def build_parser():
+    """
+    :return: Argument parser for the stream options
+    """
     parser = argparse.ArgumentParser(description='Capture motion events from a connected webcam')
     parser.add_argument('-d', '--headless', help='Run the program in headless mode', action='store_true')
     parser.add_argument('-X', type=int, help='The x coordinate of the motion detection area')
     parser.add_argument('-Y', type=int, help='The y coordinate of the motion detection area')
     parser.add_argument('-W', '--width', type=int, help='The width of the motion detection area from the start point')
     parser.add_argument('-H', '--height', type=int, help='The height of the motion detection area from the start point')
+    parser.add_argument('-z', '--zones', help='JSON file of named detection zones to count instead of a single area')
     parser.add_argument('-i', '--hide-images', help='Do not show the webcam feed (images hidden in headless mode)', action='store_true')
     parser.add_argument('-s', '--no-save', help='Disable saving of motion images', action='store_true')
     parser.add_argument('-l', '--no-log', help='Disable file logging of motion events', action='store_true')
+    parser.add_argument('--database', help='Also record motion events in this SQLite database (see crow_store.py)')
+    parser.add_argument('--camera', default='webcam', help='Camera name the events are recorded under in the database')
     parser.add_argument('-q', '--quiet', help='Disable logging to console', action='store_true')
-    args = parser.parse_args()
+    parser.add_argument('-b', '--background', choices=BackgroundModel.MODES, default='mean',
+                        help='Background model: mean of the frame window, recency-weighted mean or exponential moving average')
+    parser.add_argument('--window', type=int, default=30, help='Number of frames in the background window')
+    parser.add_argument('--alpha', type=float, default=0.05, help='Weight of each new frame in the ema background')
+    parser.add_argument('-r', '--roi', help='Only process the region around the motion detection area', action='store_true')
+    parser.add_argument('--roi-margin', type=int, help='Pixels processed around the detection area in ROI mode (default: dilation spread)')
+    parser.add_argument('-m', '--morphology', choices=MORPHOLOGY_ENGINES, default='separable',
+                        help='Dilation engine. All engines give the same result; iterative is slowest')
+    parser.add_argument('--queue-size', type=int, default=2, help='Number of captured frames waiting to be processed')
+    parser.add_argument('--queue-policy', choices=CaptureThread.POLICIES, default='drop-oldest',
+                        help='What to do with new frames when processing falls behind')
+    parser.add_argument('-g', '--gate', help='Skip the full detector on frames that barely differ from the background', action='store_true')
+    parser.add_argument('--gate-threshold', type=int, default=10, help='Change in a thumbnail pixel that counts as movement for the gate')
+    parser.add_argument('--gate-min-changed', type=float, default=0.001, help='Fraction of thumbnail pixels that must change to pass the gate')
+    parser.add_argument('--batch', type=int, default=0,
+                        help='Compare up to this many queued frames with the background as one numpy batch (0 = one frame at a time, with the gate)')
+    parser.add_argument('-c', '--clips', help='Save a short video clip around each detection', action='store_true')
+    parser.add_argument('--clip-before', type=float, default=3, help='Seconds of video kept from before each detection')
+    parser.add_argument('--clip-after', type=float, default=5, help='Seconds of video recorded after each detection')
+    parser.add_argument('--clip-fps', type=float, default=5, help='Frame rate of the camera feed, used to size and play back the clips')
+    parser.add_argument('-t', '--track', help='Follow blobs between frames and only report each one once per zone', action='store_true')
+    parser.add_argument('--track-distance', type=int, default=80, help='Furthest a blob can move between frames and still be tracked (pixels)')
+    parser.add_argument('--metrics', help='Time each stage of the pipeline', action='store_true')
+    parser.add_argument('--metrics-interval', type=int, default=30, help='Seconds between metrics summary lines (0 to disable)')
+    parser.add_argument('--metrics-port', type=int, help='Serve the metrics as JSON on this local port')
+    return parser
+
+
+def main(args):
+    """
+    Watch the camera and record motion events until interrupted.
+    SimpleCV is only imported here, once the arguments are known to be good
+    :param args: Options from build_parser
+    """
+    from SimpleCV import Camera
 
     cam = Camera()
-    running_average = []
+    background = BackgroundModel(window=args.window, mode=args.background, alpha=args.alpha)
 
-    for x in xrange(0, 30):
+    for x in xrange(0, args.window):
         new_image = cam.getImage()
-        append_image_to_set(new_image, running_average)
+        background.append(new_image)
+
+    # Count the zones from a file if given
+    if args.zones:
+        zones = ZoneSet.load(args.zones)
+        detection_area = zones.bounding_box()
 
     # Get the detection area from command line if define or running in headless mode
-    if args.headless or args.X or args.Y or args.width or args.height:
+    elif args.headless or args.X or args.Y or args.width or args.height:
         detection_area = (args.X, args.Y, args.width, args.height)
 
     # Grab the detection area visually by default
     else:
-        detection_area = get_bounding_box(get_running_average(running_average))
+        detection_area = get_bounding_box(background.get_image())
+
+    if not args.zones:
+        zones = ZoneSet.from_area(detection_area) if None not in detection_area else ZoneSet([])
 
     last_save_timestamp = datetime.datetime.now()
+    last_num_detections = 0
 
-    while True:
-        try:
-            next_image = cam.getImage()
-            draw_bounding_box(next_image, detection_area)
-            features = get_traffic_features(get_running_average(running_average), next_image, dilates=60)
-            num_detections = draw_features(next_image, features, detection_area)
+    # Capture runs on its own thread from here on, so slow frames don't hold up the camera
+    capture = CaptureThread(cam, max_frames=args.queue_size, policy=args.queue_policy)
+    capture.start()
+
+    # Snapshots and log lines are written in the background so detection never waits on the disk
+    event_sink = EventSink(store=EventStore(args.database) if args.database and not args.no_log else None)
+
+    tracker = None
+    if args.track:
+        tracker = CentroidTracker(max_distance=args.track_distance)
 
-            # Only count the detection if there are more in the zone compared to last frame
-            if num_detections:
-                if (datetime.datetime.now() - last_save_timestamp).seconds > 5:
-                    last_save_timestamp = datetime.datetime.now()
+    # Clips are read back out of the background window when it is long enough, so frames are never copied twice
+    clip_recorder = None
+    if args.clips:
+        frames_before = int(args.clip_before * args.clip_fps)
+        frames_after = int(args.clip_after * args.clip_fps)
+        history = None
+        if args.background != "ema" and args.window >= frames_before + frames_after + 1:
+            history = background
 
-                    # Save event info if enabled
-                    if not args.quiet:
-                        print("Motion detected - {}".format(last_save_timestamp.strftime('%Y-%m-%d %H.%M.%S')))
+        clip_recorder = ClipRecorder(frames_before, frames_after, frame_rate=args.clip_fps, history=history)
 
-                    if not args.no_save:
-                        next_image.save("{}motion {}.jpg".format("", last_save_timestamp.strftime('%Y-%m-%d %H.%M.%S')))
+    motion_gate = None
+    if args.gate:
+        motion_gate = MotionGate(pixel_threshold=args.gate_threshold, min_changed=args.gate_min_changed)
 
-                    if not args.no_log:
-                        log_file = open('{} CrowLog.log'.format(last_save_timestamp.strftime('%Y-%m')), mode='a')
-                        log_file.write(last_save_timestamp.strftime('%Y-%m-%d %H.%M.%S'))
+    if args.metrics:
+        METRICS.enabled = True
+        METRICS.register_gauge("queue_depth", capture.queue_depth)
+        METRICS.register_gauge("dropped_frames", lambda: capture.dropped)
+        METRICS.register_gauge("dropped_images", lambda: event_sink.dropped_images)
 
-            if not args.headless and not args.hide_images:
-                next_image.show()
+        if args.metrics_interval and not args.quiet:
+            start_summary_reporter(METRICS, args.metrics_interval)
+        if args.metrics_port:
+            start_metrics_server(METRICS, args.metrics_port)
 
-            append_image_to_set(next_image, running_average)
+    while True:
+        try:
+            try:
+                batch = [capture.get(timeout=1)]
+            except Empty:
+                continue
+
+            # In batch mode every frame already waiting is compared with the background in one go
+            while len(batch) < args.batch:
+                try:
+                    batch.append(capture.get(timeout=0))
+                except Empty:
+                    break
+
+            if args.batch:
+                with METRICS.time("background"):
+                    background_array = background.get_array()
+
+                batch_features = get_batch_features(background_array, [image for captured_at, image in batch], dilates=60,
+                                                    detection_area=detection_area if args.roi else None,
+                                                    roi_margin=args.roi_margin,
+                                                    morphology=args.morphology)
+
+            else:
+                captured_at, next_image = batch[0]
+                with METRICS.time("background"):
+                    background_image = background.get_image()
+
+                features = None
+                with METRICS.time("gate"):
+                    moving = motion_gate is None or motion_gate.has_motion(background_image, next_image)
+
+                if moving:
+                    features = get_traffic_features(background_image, next_image, dilates=60,
+                                                    detection_area=detection_area if args.roi else None,
+                                                    roi_margin=args.roi_margin,
+                                                    morphology=args.morphology)
+                batch_features = [features]
+
+            for (captured_at, next_image), features in zip(batch, batch_features):
+                blobs = get_blob_array(features)
+                zone_hits = zones.assign(blobs, rule="centroid")
+
+                # Overlays are only drawn if the frame is saved or shown
+                annotation = Annotation(zones, blobs, zone_hits)
+                num_detections = annotation.detections()
+
+                # With tracking on, only blobs entering a zone for the first time count
+                if tracker is not None:
+                    with METRICS.time("track"):
+                        num_detections = len(tracker.update(blobs, zone_hits))
+
+                # Each new arrival in a zone (a rise in the count, or a tracker crossing) starts or extends a clip;
+                # the five second limit only applies to snapshots
+                arrived = num_detections if tracker is not None else num_detections > last_num_detections
+                last_num_detections = num_detections
+                if arrived and clip_recorder is not None:
+                    clip_recorder.trigger("motion {}.avi".format(captured_at.strftime('%Y-%m-%d %H.%M.%S')))
+
+                # A shown frame is drawn on here, before it can be handed to the event sink; once the sink has an
+                # image its worker thread may be drawing on and saving it, so this thread mustn't touch its layers
+                show_feed = not args.headless and not args.hide_images
+                if show_feed:
+                    with METRICS.time("draw"):
+                        annotation.render(next_image)
+
+                # Only count the detection if there are more in the zone compared to last frame
+                if num_detections:
+                    if (captured_at - last_save_timestamp).seconds > 5:
+                        last_save_timestamp = captured_at
+
+                        # Save event info if enabled
+                        if not args.quiet:
+                            print("Motion detected - {}".format(last_save_timestamp.strftime('%Y-%m-%d %H.%M.%S')))
+
+                        with METRICS.time("events"):
+                            snapshot = None
+                            if not args.no_save:
+                                snapshot = "{}motion {}.jpg".format("", last_save_timestamp.strftime('%Y-%m-%d %H.%M.%S'))
+                                if not event_sink.save_image(next_image, snapshot, annotation=None if show_feed else annotation):
+                                    snapshot = None
+
+                            if not args.no_log:
+                                zone_counts = zone_hits.sum(axis=0)
+                                log_line = last_save_timestamp.strftime('%Y-%m-%d %H.%M.%S')
+                                if len(zones) > 1:
+                                    log_line += "," + ";".join(name for name, count in zip(zones.names, zone_counts) if count)
+
+                                event_sink.log('{} CrowLog.log'.format(last_save_timestamp.strftime('%Y-%m')), log_line + "\n")
+
+                                blob_sizes = get_zone_blob_sizes(blobs, zone_hits)
+                                for zone in numpy.flatnonzero(zone_counts):
+                                    event_sink.record(last_save_timestamp, zones.names[zone], args.camera, blob_sizes[zone], snapshot)
+
+                if show_feed:
+                    next_image.show()
+
+                with METRICS.time("background"):
+                    background.append(next_image)
+
+                if clip_recorder is not None:
+                    clip_recorder.append(next_image)
+
+                if METRICS.enabled:
+                    METRICS.mark_frame()
+                    METRICS.record("latency", (datetime.datetime.now() - captured_at).total_seconds())
 
         except KeyboardInterrupt:
+            capture.stop()
+            event_sink.close()
+            if clip_recorder is not None:
+                clip_recorder.close()
+
+            if not args.quiet:
+                print("Captured {} frames, dropped {}".format(capture.captured, capture.dropped))
+                if motion_gate is not None:
+                    print(motion_gate.summary())
+                if clip_recorder is not None:
+                    print("Saved {} clips, dropped {}".format(clip_recorder.saved_clips, clip_recorder.dropped_clips))
+
             sys.exit(0)
+
+
+if __name__ == '__main__':
+    main(build_parser().parse_args())
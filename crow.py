@@ -0,0 +1,112 @@
+"""
+Command line entry point for the counters.
+
+    python crow.py count [--config settings.json]
+    python crow.py stream [--config settings.json] [CrowStream options...]
+    python crow.py cameras cameras.json [crow_supervisor options...]
+
+Only the parts a command needs are imported, after its arguments are checked. SimpleCV's display stack and the
+bounding box GUI are never loaded unless a detection area has to be picked on screen or the feed is shown.
+
+The config file is JSON:
+
+    {
+        "settings": {"VIDEO_PATH": "/data/video/", "DETECTION_AREA": [100, 200, 300, 80], "PROCESSES": 4},
+        "stream": {"headless": true, "detection_area": [100, 200, 300, 80], "background": "ema", "track": true}
+    }
+
+"settings" override crow_config for count; "stream" holds CrowStream options by their long names.
+"""
+import argparse
+import json
+import os
+import sys
+
+# CrowStream flags with no long name
+STREAM_SHORT_FLAGS = {"x": "-X", "y": "-Y"}
+
+
+def load_config(path):
+    """
+    :param path: JSON config file, or None
+    :return: Config dictionary (empty if no file)
+    """
+    if path is None:
+        return {}
+
+    with open(path) as config_file:
+        return json.load(config_file)
+
+
+def get_stream_argv(options):
+    """
+    Turn the "stream" section of a config file into CrowStream arguments
+    :param options: Dictionary of option name: value. True = bare flag, False/None = left out
+    :return: List of command line arguments
+    """
+    argv = []
+
+    for name, value in sorted(options.items()):
+        if name == "detection_area":
+            x, y, width, height = value
+            argv.extend(["-X", str(x), "-Y", str(y), "--width", str(width), "--height", str(height)])
+            continue
+
+        flag = STREAM_SHORT_FLAGS.get(name.lower(), "--" + name.replace("_", "-"))
+        if value is True:
+            argv.append(flag)
+        elif value is not None and value is not False:
+            argv.extend([flag, str(value)])
+
+    return argv
+
+
+def count(args):
+    if args.config:
+        # crow_config reads the overrides when it is imported, here and in any pool workers
+        os.environ["CROW_CONFIG"] = os.path.abspath(args.config)
+
+    import CarCrow
+    CarCrow.main()
+
+
+def stream(args):
+    config = load_config(args.config)
+    extra = args.options[1:] if args.options[:1] == ["--"] else args.options
+
+    import CrowStream
+    parser = CrowStream.build_parser()
+    CrowStream.main(parser.parse_args(get_stream_argv(config.get("stream", {})) + extra))
+
+
+def cameras(args):
+    import crow_supervisor
+    crow_supervisor.main(args.options)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Count traffic in recorded videos or from live cameras')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    count_parser = commands.add_parser('count', help='Count traffic in the videos set up in crow_config')
+    count_parser.add_argument('--config', help='JSON file of crow_config settings to override')
+    count_parser.set_defaults(run=count)
+
+    stream_parser = commands.add_parser('stream', help='Capture motion events from a connected webcam',
+                                        description='Options after the config are passed to CrowStream and override the file')
+    stream_parser.add_argument('--config', help='JSON file with a "stream" section of CrowStream options')
+    stream_parser.add_argument('options', nargs=argparse.REMAINDER, help='CrowStream options')
+    stream_parser.set_defaults(run=stream)
+
+    cameras_parser = commands.add_parser('cameras', help='Capture motion events from several cameras in one process',
+                                         add_help=False)
+    cameras_parser.add_argument('options', nargs=argparse.REMAINDER, help='crow_supervisor arguments')
+    cameras_parser.set_defaults(run=cameras)
+
+    args = parser.parse_args(argv)
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
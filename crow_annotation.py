@@ -0,0 +1,51 @@
+from crow_zones import BLOB_X, BLOB_Y, BLOB_MIN_X, BLOB_MAX_X, BLOB_MIN_Y, BLOB_MAX_Y, BLOB_CENTROID_X, BLOB_CENTROID_Y
+
+
+class Annotation(object):
+    """
+    What would be drawn on a frame: the zone boxes, and each blob's box and centroid coloured by whether it is in a zone.
+    Building one is just a couple of array references; the SimpleCV drawing layers are only made in render(),
+    so frames that are never saved or shown never pay for them.
+    """
+    __slots__ = ("zones", "blobs", "in_zone")
+
+    def __init__(self, zones=(), blobs=None, zone_hits=None):
+        """
+        :param zones: Iterable of (name, (x, y, w, h)) zone boxes, e.g. a ZoneSet
+        :param blobs: Blob array from crow_zones.get_blob_array
+        :param zone_hits: Boolean array (blobs x zones) from ZoneSet.assign
+        """
+        self.zones = zones
+        self.blobs = blobs
+        self.in_zone = zone_hits.any(axis=1) if zone_hits is not None and len(blobs) else None
+
+    def detections(self):
+        """
+        :return: Number of blobs in any zone
+        """
+        return int(self.in_zone.sum()) if self.in_zone is not None else 0
+
+    def render(self, image):
+        """
+        Draw the annotation onto an image's drawing layer
+        :param image: SimpleCV image of the frame the annotation was made from
+        :return: The same image
+        """
+        from SimpleCV import Color
+
+        for name, area in self.zones:
+            image.drawRectangle(area[0], area[1], area[2], area[3], color=Color.VIOLET, width=2)
+
+        if self.blobs is not None:
+            for index, blob in enumerate(self.blobs):
+                # Paint the blob box green if in a detection zone
+                detection_colour = Color.FORESTGREEN if self.in_zone is not None and self.in_zone[index] else Color.RED
+
+                width = blob[BLOB_MAX_X] - blob[BLOB_MIN_X]
+                height = blob[BLOB_MAX_Y] - blob[BLOB_MIN_Y]
+                image.drawRectangle(blob[BLOB_X] - (width / 2), blob[BLOB_Y] - (height / 2), width, height,
+                                    color=detection_colour, width=3)
+                image.drawCircle(ctr=(blob[BLOB_CENTROID_X], blob[BLOB_CENTROID_Y]), rad=10,
+                                 color=Color.LEGO_ORANGE, thickness=5)
+
+        return image
@@ -0,0 +1,131 @@
+import numpy
+
+
+class BackgroundModel(object):
+    """
+    Running background estimate over the most recent frames.
+    Every update costs the same regardless of window length:
+
+    mean     - plain average of the last `window` frames, kept as a running sum over a ring buffer
+    weighted - average of the last `window` frames with linear weights favouring the newest frames
+    ema      - exponential moving average; `alpha` is the weight of each new frame
+    """
+
+    MODES = ("mean", "weighted", "ema")
+
+    def __init__(self, window=30, mode="mean", alpha=0.05):
+        """
+        :param window: Number of frames in the averaging window (mean and weighted modes)
+        :param mode: One of BackgroundModel.MODES
+        :param alpha: Weight of each new frame in ema mode
+        """
+        if mode not in self.MODES:
+            raise ValueError("Unknown background mode '{}'. Use one of: {}".format(mode, ", ".join(self.MODES)))
+
+        self.window = window
+        self.mode = mode
+        self.alpha = alpha
+
+        self.count = 0
+        self._ring = None
+        self._index = 0
+        self._sum = None
+        self._weighted_sum = None
+        self._average = None
+
+    def __len__(self):
+        return min(self.count, self.window) if self.mode != "ema" else self.count
+
+    @classmethod
+    def from_images(cls, image_set, **kwargs):
+        """
+        Build a background model from an existing image set, oldest image first
+        """
+        model = cls(window=max(len(image_set), 1), **kwargs)
+        for image in image_set:
+            model.append(image)
+
+        return model
+
+    def _allocate(self, frame):
+        if self.mode == "ema":
+            self._average = frame.astype(numpy.float32)
+        else:
+            self._ring = numpy.zeros((self.window,) + frame.shape, dtype=numpy.uint8)
+            self._sum = numpy.zeros(frame.shape, dtype=numpy.int32)
+            self._weighted_sum = numpy.zeros(frame.shape, dtype=numpy.int32)
+
+    def append(self, image):
+        """
+        Add a new frame to the background
+        :param image: SimpleCV image or BGR numpy array
+        """
+        frame = _to_array(image)
+
+        if self.count == 0:
+            self._allocate(frame)
+
+        if self.mode == "ema":
+            if self.count:
+                self._average += self.alpha * (frame - self._average)
+
+        else:
+            full = self.count >= self.window
+
+            # Weights run 1..n from oldest to newest, so every old frame loses one weight step
+            # W' = W - S + n * new  when the window is full, or  W + (n + 1) * new  while it fills
+            if full:
+                self._weighted_sum -= self._sum
+                self._weighted_sum += self.window * frame.astype(numpy.int32)
+                self._sum -= self._ring[self._index]
+            else:
+                self._weighted_sum += (self.count + 1) * frame.astype(numpy.int32)
+
+            self._sum += frame
+            self._ring[self._index] = frame
+            self._index = (self._index + 1) % self.window
+
+        self.count += 1
+
+    def recent(self, count):
+        """
+        Copy the newest frames out of the frame window (mean and weighted modes)
+        :param count: Number of frames wanted
+        :return: numpy array (frames, height, width, 3) of up to `count` frames, oldest first
+        """
+        count = min(count, len(self))
+        return self._ring[[(self._index - count + offset) % self.window for offset in range(count)]]
+
+    def get_array(self):
+        """
+        :return: Current background as a BGR numpy array
+        """
+        if self.count == 0:
+            return None
+
+        if self.mode == "ema":
+            return self._average.astype(numpy.uint8)
+
+        frames = len(self)
+        if self.mode == "weighted":
+            return (self._weighted_sum // (frames * (frames + 1) // 2)).astype(numpy.uint8)
+
+        return (self._sum // frames).astype(numpy.uint8)
+
+    def get_image(self):
+        """
+        :return: Current background as a SimpleCV image
+        """
+        from SimpleCV import Image
+
+        if self.count == 0:
+            return None
+
+        return Image(self.get_array(), cv2image=True)
+
+
+def _to_array(image):
+    if isinstance(image, numpy.ndarray):
+        return image
+
+    return image.getNumpyCv2()
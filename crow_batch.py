@@ -0,0 +1,230 @@
+"""
+Frame-stack versions of the pixel stages of the detector.
+
+Frames are processed a chunk at a time as one (frames, height, width, 3) array, so the smoothing, differencing,
+grayscale conversion and thresholding run as a handful of numpy operations per chunk instead of a chain of SimpleCV
+calls per frame. Each stage reproduces the OpenCV routine SimpleCV calls (same kernel, border handling and fixed-point
+rounding), so the masks match the per-frame pipeline pixel for pixel; check_masks (or running this module on a video)
+confirms it. The masks then go through the rest of the detector (erode, dilate, blur, blobs) one frame at a time with
+get_mask_features.
+Grayscale stacks (frames, height, width), e.g. straight from the frame cache, go through the same stages with gray=True.
+"""
+import sys
+
+import numpy
+
+from crow_metrics import METRICS
+from crow_morphology import dilate_image
+from crow_roi import offset_features
+
+# Fixed-point weights OpenCV uses for BGR to grayscale (blue, green, red), scaled by 2 ** GRAY_SHIFT
+GRAY_WEIGHTS = (1868, 9617, 4899)
+GRAY_SHIFT = 14
+
+
+def iter_chunks(arrays, chunk_size=16):
+    """
+    Gather frames into chunks
+    :param arrays: Iterable of BGR numpy arrays (height, width, 3), e.g. FrameSource.arrays()
+    :param chunk_size: Number of frames per chunk
+    :return: Generator of (frames, height, width, 3) arrays. The same buffer is reused for every chunk,
+             so each chunk is only valid until the next one is requested
+    """
+    buffer = None
+    filled = 0
+
+    for array in arrays:
+        if buffer is None:
+            buffer = numpy.empty((chunk_size,) + array.shape, dtype=numpy.uint8)
+
+        buffer[filled] = array
+        filled += 1
+
+        if filled == chunk_size:
+            yield buffer
+            filled = 0
+
+    if filled:
+        yield buffer[:filled]
+
+
+def crop_stack(stack, roi=None):
+    """
+    :param stack: Frame stack (frames, height, width, ...)
+    :param roi: Tuple containing x, y, w, h to crop to, or None for whole frames
+    :return: View of the region in every frame
+    """
+    if roi is None:
+        return stack
+
+    return stack[:, roi[1]:roi[1] + roi[3], roi[0]:roi[0] + roi[2]]
+
+
+def smooth_stack(stack):
+    """
+    3x3 Gaussian blur of every frame, the same as SimpleCV's default smooth()
+    :param stack: Frame stack (frames, height, width, ...) of uint8
+    :return: Smoothed stack
+    """
+    pad = [(0, 0), (1, 1), (1, 1)] + [(0, 0)] * (stack.ndim - 3)
+    padded = numpy.pad(stack, pad, mode="edge").astype(numpy.uint16)
+
+    rows = padded[:, :-2] + 2 * padded[:, 1:-1] + padded[:, 2:]
+    total = rows[:, :, :-2] + 2 * rows[:, :, 1:-1] + rows[:, :, 2:]
+
+    return ((total + 8) >> 4).astype(numpy.uint8)
+
+
+def subtract_gray(before, after):
+    """
+    Saturating before - after, converted to grayscale
+    :param before: BGR frames, or a single BGR frame to compare every 'after' frame with
+    :param after: BGR frame stack, or a single BGR frame to compare every 'before' frame with
+    :return: Grayscale difference stack (frames, height, width) as uint32
+    """
+    gray = numpy.zeros(numpy.broadcast(before[..., 0], after[..., 0]).shape, dtype=numpy.uint32)
+
+    for channel, weight in enumerate(GRAY_WEIGHTS):
+        difference = before[..., channel].astype(numpy.int32) - after[..., channel]
+        gray += weight * numpy.maximum(difference, 0).astype(numpy.uint32)
+
+    return (gray + (1 << (GRAY_SHIFT - 1))) >> GRAY_SHIFT
+
+
+def subtract_saturating(before, after):
+    """
+    Saturating before - after of grayscale frames.
+    Gives exactly what subtract_gray does for the same frames converted to BGR, as the grayscale weights add up to one
+    :param before: Grayscale frames, or a single frame to compare every 'after' frame with
+    :param after: Grayscale frame stack
+    :return: Difference stack (frames, height, width)
+    """
+    return numpy.maximum(before.astype(numpy.int16) - after, 0)
+
+
+def frame_diff_masks(smoothed, last_smoothed, threshold=20, gray=False):
+    """
+    Movement masks between every consecutive pair of smoothed frames
+    :param smoothed: Smoothed frame stack
+    :param last_smoothed: Smoothed frame before the first in the stack (compared with itself if None)
+    :param threshold: Pixel change needed to count as movement
+    :param gray: The frames are grayscale (frames, height, width) rather than BGR
+    :return: Boolean stack (frames, height, width), True where a pixel moved
+    """
+    subtract = subtract_saturating if gray else subtract_gray
+    masks = numpy.empty(smoothed.shape[:3], dtype=bool)
+
+    masks[0] = subtract(smoothed[0] if last_smoothed is None else last_smoothed, smoothed[:1])[0] > threshold
+    if len(smoothed) > 1:
+        masks[1:] = subtract(smoothed[:-1], smoothed[1:]) > threshold
+
+    return masks
+
+
+def background_diff_masks(smoothed, background_smoothed, threshold=20):
+    """
+    Movement masks between every frame in a stack and one background
+    :param smoothed: Smoothed frame stack
+    :param background_smoothed: Smoothed background frame
+    :param threshold: Pixel change needed to count as movement
+    :return: Boolean stack (frames, height, width), True where a pixel moved
+    """
+    return subtract_gray(background_smoothed, smoothed) > threshold
+
+
+def get_mask_features(mask_image,
+                      erodes=3,
+                      dilates=40,
+                      smooth_aperture=(19, 19),
+                      blob_min=30,
+                      roi=None,
+                      morphology="iterative"):
+    """
+    Find movement features in a thresholded movement mask: the stages after the threshold.
+    See CarCrow.get_traffic_features for the detection parameters.
+
+    :param mask_image: SimpleCV image that is white where pixels moved
+    :param roi: Region the mask covers, used to map blobs back to full-frame coordinates
+    :return: feature set for detected movement
+    """
+    with METRICS.time("erode"):
+        detect_image = mask_image.erode(iterations=erodes)  # Cut small movements out
+    with METRICS.time("dilate"):
+        detect_image = dilate_image(detect_image, dilates,
+                                    engine=morphology)  # Blow up the remaining blobs to combine into large movements
+    with METRICS.time("blur"):
+        detect_image = detect_image.smooth(aperature=smooth_aperture)  # Blur blobs together like a lava lamp
+
+    with METRICS.time("blobs"):
+        features = detect_image.findBlobs(minsize=blob_min)  # Detect and sort out blobs
+
+        if roi is not None:
+            features = offset_features(features, roi)
+
+    return features
+
+
+def get_mask_image(mask):
+    """
+    :param mask: Boolean numpy array (height, width), True where pixels moved
+    :return: SimpleCV image of the mask, white where pixels moved
+    """
+    from SimpleCV import Image
+
+    mask = mask.astype(numpy.uint8) * 255
+    return Image(numpy.dstack((mask, mask, mask)), cv2image=True)
+
+
+def check_masks(arrays, threshold=20, roi=None):
+    """
+    Compare the batched masks against the per-frame pipeline: CarCrow.prepare_frame on each frame, then SimpleCV's
+    subtract and threshold on each consecutive pair (the first frame is compared with itself, like find_traffic).
+    The grayscale path is checked against the BGR one on the same frames in grayscale.
+
+    :param arrays: List of BGR numpy arrays (height, width, 3), in order
+    :param threshold: Pixel change needed to count as movement
+    :param roi: Tuple containing x, y, w, h to crop every frame to, or None for whole frames
+    :return: Dictionary of path ("bgr", "gray"): number of mask pixels that differ over all the frames
+    """
+    from SimpleCV import Image
+    from CarCrow import prepare_frame
+
+    stack = numpy.array(arrays, dtype=numpy.uint8)
+    masks = frame_diff_masks(smooth_stack(crop_stack(stack, roi)), None, threshold)
+
+    prepared = [prepare_frame(Image(array.copy(), cv2image=True), roi) for array in arrays]
+    mismatches = {"bgr": 0, "gray": 0}
+
+    for index, after in enumerate(prepared):
+        before = prepared[max(index - 1, 0)]
+        expected = (before - after).threshold(threshold).getGrayNumpyCv2() > 0
+        mismatches["bgr"] += int(numpy.count_nonzero(masks[index] != expected))
+
+    # Grayscale frames, as the frame cache stores them, against the same frames converted back to BGR
+    grays = subtract_gray(stack, numpy.zeros_like(stack[0])).astype(numpy.uint8)  # Frame - black = its grayscale
+    gray_masks = frame_diff_masks(smooth_stack(crop_stack(grays, roi)), None, threshold, gray=True)
+    bgr_masks = frame_diff_masks(smooth_stack(crop_stack(grays[..., None].repeat(3, axis=-1), roi)), None, threshold)
+    mismatches["gray"] = int(numpy.count_nonzero(gray_masks != bgr_masks))
+
+    return mismatches
+
+
+if __name__ == '__main__':
+    from crow_frames import FFmpegFrameSource
+
+    video = sys.argv[1]
+    frame_count = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    threshold = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+
+    arrays = []
+    for array in FFmpegFrameSource(video).arrays():
+        arrays.append(array.copy())
+        if len(arrays) == frame_count:
+            break
+
+    mismatches = check_masks(arrays, threshold)
+
+    for path in ("bgr", "gray"):
+        print("{:5} {}".format(path, "OK" if mismatches[path] == 0 else "{} pixels differ".format(mismatches[path])))
+
+    sys.exit(1 if any(mismatches.values()) else 0)
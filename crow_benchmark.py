@@ -0,0 +1,314 @@
+"""
+Benchmark the detection pipeline on synthetic traffic video.
+
+Frames are generated offline (noisy static background with rectangles driving across it), so runs are
+repeatable on any machine. Results are printed and written to a JSON file; pass --compare with an older results
+file to see the change in frame rate. Each resolution runs in its own process, so its peak memory is its own.
+
+    python crow_benchmark.py --resolutions 320x240,640x480 --frames 60 --output bench.json
+"""
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import time
+
+import numpy
+from SimpleCV import Image
+
+import CarCrow
+import CrowStream
+from crow_annotation import Annotation
+from crow_background import BackgroundModel
+from crow_config import *
+from crow_gate import MotionGate
+from crow_morphology import dilate_image
+from crow_roi import offset_features
+from crow_zones import ZoneSet, get_blob_array
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def generate_frames(width, height, count, vehicles=4, noise=3.0, seed=0):
+    """
+    Generate a deterministic synthetic traffic sequence
+    :param width: Frame width
+    :param height: Frame height
+    :param count: Number of frames
+    :param vehicles: Number of rectangles driving across the frame
+    :param noise: Standard deviation of the per-frame sensor noise
+    :param seed: Random seed
+    :return: List of BGR numpy arrays
+    """
+    random = numpy.random.RandomState(seed)
+    background = random.randint(60, 120, size=(height, width, 3)).astype(numpy.int16)
+
+    lanes = []
+    for vehicle in range(vehicles):
+        lane_height = max(height // (vehicles + 2), 4)
+        lanes.append({
+            "y": (vehicle + 1) * height // (vehicles + 1) - lane_height // 2,
+            "w": max(width // 8, 4),
+            "h": lane_height,
+            "x": random.randint(-width // 2, width),
+            "speed": random.randint(max(width // 60, 1), max(width // 20, 2)) * random.choice([-1, 1]),
+            "colour": random.randint(150, 255, size=3),
+        })
+
+    frames = []
+    for _ in range(count):
+        frame = background + random.normal(0, noise, size=background.shape).astype(numpy.int16)
+
+        for lane in lanes:
+            lane["x"] += lane["speed"]
+            if lane["x"] > width:
+                lane["x"] = -lane["w"]
+            elif lane["x"] < -lane["w"]:
+                lane["x"] = width
+
+            xmin = max(lane["x"], 0)
+            xmax = min(lane["x"] + lane["w"], width)
+            if xmax > xmin:
+                frame[lane["y"]:lane["y"] + lane["h"], xmin:xmax] = lane["colour"]
+
+        frames.append(numpy.clip(frame, 0, 255).astype(numpy.uint8))
+
+    return frames
+
+
+def get_peak_memory():
+    """
+    :return: Peak resident memory of this process in megabytes, or None if it can't be measured.
+             This is the peak over the life of the process, so run_isolated gives each resolution its own process
+    """
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return peak / (1024.0 * 1024.0) if sys.platform == "darwin" else peak / 1024.0
+
+
+def summarise(samples):
+    """
+    :param samples: List of durations in seconds
+    :return: Dictionary of latency statistics in milliseconds
+    """
+    samples = numpy.array(samples) * 1000.0
+    return {
+        "count": len(samples),
+        "mean_ms": float(samples.mean()),
+        "p50_ms": float(numpy.percentile(samples, 50)),
+        "p90_ms": float(numpy.percentile(samples, 90)),
+        "p99_ms": float(numpy.percentile(samples, 99)),
+        "max_ms": float(samples.max()),
+    }
+
+
+def time_stages(images, detection_area, dilates=DILATE_ITERATIONS, morphology=MORPHOLOGY_ENGINE):
+    """
+    Time each step of CarCrow's feature extraction separately over consecutive frame pairs
+    :return: Dictionary of stage name: list of durations in seconds
+    """
+    stages = ["gate", "prepare", "subtract", "threshold", "erode", "dilate", "blur", "blobs"]
+    timings = dict((stage, []) for stage in stages)
+
+    roi = CarCrow.get_detection_roi(images[0], detection_area if DETECTION_ROI else None, dilates,
+                                    SMOOTHING_APERTURE, ROI_MARGIN, ERODE_ITERATIONS)
+    motion_gate = MotionGate(scale=GATE_SCALE, pixel_threshold=GATE_PIXEL_THRESHOLD, min_changed=GATE_MIN_CHANGED)
+    last_prepared = CarCrow.prepare_frame(images[0], roi)
+
+    for image in images[1:]:
+        start = time.time()
+        prepared = CarCrow.prepare_frame(image, roi)
+        timings["prepare"].append(time.time() - start)
+
+        start = time.time()
+        motion_gate.has_motion(last_prepared, prepared)
+        timings["gate"].append(time.time() - start)
+
+        start = time.time()
+        detect_image = last_prepared - prepared
+        timings["subtract"].append(time.time() - start)
+
+        start = time.time()
+        detect_image = detect_image.threshold(THRESHOLD_MINIMUM)
+        timings["threshold"].append(time.time() - start)
+
+        start = time.time()
+        detect_image = detect_image.erode(iterations=ERODE_ITERATIONS)
+        timings["erode"].append(time.time() - start)
+
+        start = time.time()
+        detect_image = dilate_image(detect_image, dilates, engine=morphology)
+        timings["dilate"].append(time.time() - start)
+
+        start = time.time()
+        detect_image = detect_image.smooth(aperature=SMOOTHING_APERTURE)
+        timings["blur"].append(time.time() - start)
+
+        start = time.time()
+        features = detect_image.findBlobs(minsize=MIN_BLOB_SIZE)
+        if roi is not None:
+            offset_features(features, roi)
+        timings["blobs"].append(time.time() - start)
+
+        last_prepared = prepared
+
+    return timings
+
+
+def time_find_traffic(images, detection_area):
+    """
+    Run CarCrow.find_traffic over the frames with all output turned off
+    :return: Frames per second
+    """
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+
+    try:
+        start = time.time()
+        CarCrow.find_traffic(images, timestamp=datetime.datetime(2015, 1, 1), detection_area=detection_area,
+                             output_images=False, output_log=False)
+        elapsed = time.time() - start
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    return len(images) / elapsed
+
+
+def time_stream_loop(images, detection_area, window=30):
+    """
+    Run CrowStream's per-frame work (background update, feature extraction and annotation) over the frames
+    :return: Dictionary of stage name: list of durations in seconds, and frames per second
+    """
+    timings = {"background": [], "features": [], "annotate": []}
+    zones = ZoneSet.from_area(detection_area)
+    background = BackgroundModel(window=window)
+    for image in images[:window]:
+        background.append(image)
+
+    loop_start = time.time()
+    for image in images:
+        start = time.time()
+        background_image = background.get_image()
+        background.append(image)
+        timings["background"].append(time.time() - start)
+
+        start = time.time()
+        features = CrowStream.get_traffic_features(background_image, image, dilates=60)
+        timings["features"].append(time.time() - start)
+
+        # Overlays are only recorded here; they are drawn when a frame is saved or shown
+        start = time.time()
+        blobs = get_blob_array(features)
+        Annotation(zones, blobs, zones.assign(blobs, rule="centroid")).detections()
+        timings["annotate"].append(time.time() - start)
+
+    return timings, len(images) / (time.time() - loop_start)
+
+
+def run_benchmark(width, height, frame_count, seed=0):
+    """
+    Benchmark every pipeline at one resolution
+    :return: Dictionary of results
+    """
+    arrays = generate_frames(width, height, frame_count, seed=seed)
+    images = [Image(array, cv2image=True) for array in arrays]
+    detection_area = (width // 4, height // 4, width // 2, height // 2)
+
+    stages = time_stages(images, detection_area)
+    find_traffic_fps = time_find_traffic(images, detection_area)
+    stream_stages, stream_fps = time_stream_loop(images, detection_area)
+
+    return {
+        "resolution": "{}x{}".format(width, height),
+        "frames": frame_count,
+        "find_traffic_fps": find_traffic_fps,
+        "stream_fps": stream_fps,
+        "stages": dict((stage, summarise(samples)) for stage, samples in stages.items()),
+        "stream_stages": dict((stage, summarise(samples)) for stage, samples in stream_stages.items()),
+        "peak_memory_mb": get_peak_memory(),
+    }
+
+
+def run_isolated(width, height, frame_count, seed=0):
+    """
+    Run run_benchmark in a fresh worker process, so its peak memory is its own and not the largest of every
+    resolution run so far
+    :return: Dictionary of results
+    """
+    pool = multiprocessing.Pool(1)
+    try:
+        return pool.apply(run_benchmark, (width, height, frame_count, seed))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def print_results(result, previous=None):
+    print("{resolution}: find_traffic {find_traffic_fps:.1f} fps, stream loop {stream_fps:.1f} fps".format(**result))
+
+    if previous is not None:
+        print("    vs previous: find_traffic {:+.1%}, stream loop {:+.1%}".format(
+            result["find_traffic_fps"] / previous["find_traffic_fps"] - 1,
+            result["stream_fps"] / previous["stream_fps"] - 1))
+
+    for group in ("stages", "stream_stages"):
+        for stage, stats in sorted(result[group].items()):
+            print("    {:12} p50 {p50_ms:8.2f} ms   p90 {p90_ms:8.2f} ms   p99 {p99_ms:8.2f} ms".format(stage, **stats))
+
+    if result["peak_memory_mb"] is not None:
+        print("    peak memory {:.1f} MB".format(result["peak_memory_mb"]))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the motion detection pipeline on synthetic video')
+    parser.add_argument('-r', '--resolutions', default='320x240,640x480,1280x720',
+                        help='Comma separated list of WIDTHxHEIGHT frame sizes')
+    parser.add_argument('-n', '--frames', type=int, default=60, help='Number of frames per resolution')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for the synthetic video')
+    parser.add_argument('-o', '--output', default='benchmark_results.json', help='JSON file to write the results to')
+    parser.add_argument('-c', '--compare', help='Earlier results file to compare against')
+    args = parser.parse_args()
+
+    previous = {}
+    if args.compare:
+        with open(args.compare) as compare_file:
+            previous = dict((result["resolution"], result) for result in json.load(compare_file)["results"])
+
+    results = []
+    for resolution in args.resolutions.split(","):
+        width, height = [int(size) for size in resolution.lower().split("x")]
+        result = run_isolated(width, height, args.frames, seed=args.seed)
+        print_results(result, previous.get(result["resolution"]))
+        results.append(result)
+
+    report = {
+        "date": datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {
+            "threshold": THRESHOLD_MINIMUM,
+            "erodes": ERODE_ITERATIONS,
+            "dilates": DILATE_ITERATIONS,
+            "smooth_aperture": SMOOTHING_APERTURE,
+            "blob_min": MIN_BLOB_SIZE,
+            "roi": DETECTION_ROI,
+            "morphology": MORPHOLOGY_ENGINE,
+            "motion_gate": MOTION_GATE,
+        },
+        "results": results,
+    }
+
+    with open(args.output, "w") as output_file:
+        json.dump(report, output_file, indent=2)
+
+    print("Results written to {}".format(args.output))
@@ -0,0 +1,209 @@
+import hashlib
+import json
+import os
+import time
+
+import cv2
+import numpy
+
+from crow_frames import FrameSource, FFmpegFrameSource, FRAME_DECODERS
+
+
+class FrameCache(object):
+    """
+    Decoded frames kept on disk between runs, so re-analysing the same recordings skips ffmpeg entirely.
+
+    Each video is stored once as a flat file of downscaled grayscale frames and opened as a read-only memory map,
+    so reading it back costs no more than the page cache. Entries are keyed by the video's path, size and
+    modification time plus the decode settings; a changed video or different settings get a fresh entry.
+    Once the cache grows past max_bytes the least recently used entries are removed.
+    """
+
+    INDEX_FILENAME = "index.json"
+
+    def __init__(self, folder, max_bytes=4 * 1024 ** 3):
+        """
+        :param folder: Folder for the cache files. Created if it doesn't exist
+        :param max_bytes: Total size of cached frames to keep
+        """
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(folder, self.INDEX_FILENAME)
+        self.entries = {}
+
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as index_file:
+                self.entries = json.load(index_file)
+
+    def key(self, video, frame_rate=5, scale=1.0):
+        """
+        :return: Cache key for a video decoded with the given settings
+        """
+        stat = os.stat(video)
+        settings = [os.path.abspath(video), stat.st_size, stat.st_mtime, frame_rate, scale]
+        return hashlib.sha1(json.dumps(settings).encode()).hexdigest()
+
+    def get(self, video, frame_rate=5, scale=1.0):
+        """
+        Frames of a video, decoding and storing them first if they aren't cached
+        :param video: Video path
+        :param frame_rate: Rate that frames are sampled from the video
+        :param scale: Factor to shrink the frames by before caching (1.0 = full size)
+        :return: Read-only numpy memmap of grayscale frames (frames, height, width)
+        """
+        key = self.key(video, frame_rate, scale)
+        entry = self.entries.get(key)
+
+        if entry is None or not os.path.exists(self._path(key)):
+            entry = self._store(key, video, frame_rate, scale)
+
+        entry["last_used"] = time.time()
+        self._save_index()
+
+        if not entry["frames"]:
+            return numpy.zeros([0] + entry["shape"], dtype=numpy.uint8)
+
+        return numpy.memmap(self._path(key), dtype=numpy.uint8, mode="r", shape=tuple([entry["frames"]] + entry["shape"]))
+
+    def size(self):
+        """
+        :return: Total size of the cached frames in bytes
+        """
+        return sum(entry["bytes"] for entry in self.entries.values())
+
+    def evict(self, keep=None):
+        """
+        Remove the least recently used entries until the cache fits in max_bytes
+        :param keep: Key of an entry that must not be removed
+        """
+        for key in sorted(self.entries, key=lambda key: self.entries[key]["last_used"]):
+            if self.size() <= self.max_bytes:
+                break
+
+            if key == keep:
+                continue
+
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                # Still mapped by someone (Windows won't remove open files); try again next time
+                continue
+
+            del self.entries[key]
+
+        self._save_index()
+
+    def _store(self, key, video, frame_rate, scale):
+        """
+        Decode a video into the cache
+        :return: Index entry for the video
+        """
+        temp_path = self._path(key) + ".tmp"
+        frames = 0
+        shape = None
+
+        with open(temp_path, "wb") as frame_file:
+            for array in FFmpegFrameSource(video, frame_rate=frame_rate).arrays():
+                gray = cv2.cvtColor(array, cv2.COLOR_BGR2GRAY)
+                if scale != 1.0:
+                    gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+                frame_file.write(gray.tostring())
+                shape = list(gray.shape)
+                frames += 1
+
+        if shape is None:
+            width, height, duration = FFmpegFrameSource(video).probe()
+            shape = [int(round(height * scale)), int(round(width * scale))]
+
+        if os.name == "nt" and os.path.exists(self._path(key)):
+            os.remove(self._path(key))
+        os.rename(temp_path, self._path(key))
+
+        entry = {
+            "video": video,
+            "frames": frames,
+            "shape": shape,
+            "bytes": frames * shape[0] * shape[1],
+            "last_used": time.time(),
+        }
+        self.entries[key] = entry
+        self.evict(keep=key)
+
+        return entry
+
+    def _path(self, key):
+        return os.path.join(self.folder, key + ".frames")
+
+    def _save_index(self):
+        temp_path = self.index_path + ".tmp"
+        with open(temp_path, "w") as index_file:
+            json.dump(self.entries, index_file, indent=2, sort_keys=True)
+
+        if os.name == "nt" and os.path.exists(self.index_path):
+            os.remove(self.index_path)
+        os.rename(temp_path, self.index_path)
+
+
+class CachedFrameSource(FrameSource):
+    """
+    Frames of a video read back from a FrameCache.
+    The frames are grayscale (and possibly downscaled), so detection areas and pixel settings are in the cached
+    frame's coordinates.
+    """
+
+    def __init__(self, video_path, cache, frame_rate=5, scale=1.0, start=0, buffers=3):
+        """
+        :param video_path: Path of the video
+        :param cache: FrameCache to read from (and fill on a miss)
+        :param frame_rate: Rate that frames are sampled from the video (frames per second)
+        :param scale: Factor the cached frames are shrunk by
+        :param start: Offset into the video to start from (seconds)
+        :param buffers: Number of BGR buffers to rotate through in arrays(). Yielded arrays stay valid for buffers - 1 frames
+        """
+        self.video_path = video_path
+        self.cache = cache
+        self.frame_rate = frame_rate
+        self.scale = scale
+        self.start = start
+        self.buffers = max(buffers, 2)
+
+    def grays(self):
+        """
+        Yield the cached grayscale frames (height, width) straight out of the memory map, without copying
+        """
+        frames = self.cache.get(self.video_path, self.frame_rate, self.scale)
+        for index in range(int(round(self.start * self.frame_rate)), len(frames)):
+            yield frames[index]
+
+    def gray_chunks(self, chunk_size=16):
+        """
+        Yield the cached grayscale frames a chunk at a time, as (frames, height, width) slices of the memory map.
+        Nothing is copied, so the detector's batched path reads them straight out of the page cache
+        """
+        frames = self.cache.get(self.video_path, self.frame_rate, self.scale)
+        for index in range(int(round(self.start * self.frame_rate)), len(frames), chunk_size):
+            yield frames[index:index + chunk_size]
+
+    def arrays(self):
+        ring = None
+        index = 0
+
+        for gray in self.grays():
+            if ring is None:
+                ring = [numpy.empty(gray.shape + (3,), dtype=numpy.uint8) for _ in range(self.buffers)]
+
+            yield cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR, dst=ring[index])
+            index = (index + 1) % self.buffers
+
+    def sample_frame(self, position=0.5):
+        from SimpleCV import Image
+
+        frames = self.cache.get(self.video_path, self.frame_rate, self.scale)
+        return Image(cv2.cvtColor(frames[int(len(frames) * position)], cv2.COLOR_GRAY2BGR), cv2image=True)
+
+
+FRAME_DECODERS["cached"] = CachedFrameSource
@@ -0,0 +1,113 @@
+import datetime
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from crow_metrics import METRICS
+
+Empty = queue.Empty
+
+
+class CaptureThread(threading.Thread):
+    """
+    Grab frames from a camera on a background thread and hand them over through a bounded queue,
+    so slow processing never stalls capture or lets the driver fill up with stale frames.
+
+    When the queue is full, the back-pressure policy decides what gives:
+    drop-oldest - throw away the oldest queued frame to make room (lowest latency)
+    drop-newest - throw away the frame that was just captured
+    block       - wait for the consumer to take a frame (nothing dropped; capture slows down)
+    """
+
+    POLICIES = ("drop-oldest", "drop-newest", "block")
+
+    def __init__(self, camera, max_frames=2, policy="drop-oldest", frame_rate=None):
+        """
+        :param camera: Anything with a getImage() method, e.g. a SimpleCV Camera
+        :param max_frames: Size of the frame queue
+        :param policy: One of CaptureThread.POLICIES
+        :param frame_rate: Most frames to grab per second, or None to grab as fast as the camera allows
+        """
+        if policy not in self.POLICIES:
+            raise ValueError("Unknown queue policy '{}'. Use one of: {}".format(policy, ", ".join(self.POLICIES)))
+
+        super(CaptureThread, self).__init__()
+        self.daemon = True
+
+        self.camera = camera
+        self.policy = policy
+        self.frames = queue.Queue(maxsize=max_frames)
+        self.frame_interval = 1.0 / frame_rate if frame_rate else 0
+
+        self.captured = 0
+        self.dropped = 0
+        self._running = threading.Event()
+        self._running.set()
+
+    def run(self):
+        next_capture = time.time()
+
+        while self._running.is_set():
+            if self.frame_interval:
+                delay = next_capture - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                next_capture = max(next_capture + self.frame_interval, time.time())
+
+            with METRICS.time("capture"):
+                image = self.camera.getImage()
+            self.captured += 1
+            self._put((datetime.datetime.now(), image))
+
+    def _put(self, item):
+        if self.policy == "block":
+            while self._running.is_set():
+                try:
+                    self.frames.put(item, timeout=0.5)
+                    return
+                except queue.Full:
+                    pass
+            return
+
+        try:
+            self.frames.put_nowait(item)
+            return
+        except queue.Full:
+            pass
+
+        if self.policy == "drop-newest":
+            self.dropped += 1
+            return
+
+        # drop-oldest: make room, retrying in case the consumer got in first
+        while True:
+            try:
+                self.frames.get_nowait()
+                self.dropped += 1
+            except queue.Empty:
+                pass
+
+            try:
+                self.frames.put_nowait(item)
+                return
+            except queue.Full:
+                pass
+
+    def get(self, timeout=None):
+        """
+        Take the next frame from the queue
+        :param timeout: Seconds to wait for a frame, or None to wait forever
+        :return: Tuple of capture time, image. Raises queue.Empty if the timeout runs out
+        """
+        return self.frames.get(timeout=timeout)
+
+    def queue_depth(self):
+        return self.frames.qsize()
+
+    def stop(self):
+        self._running.clear()
+
@@ -0,0 +1,182 @@
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import cv2
+import numpy
+
+from crow_metrics import METRICS
+
+
+class FrameRing(object):
+    """
+    Preallocated ring of the most recent frames, for when there is no BackgroundModel window to borrow
+    """
+
+    def __init__(self, size):
+        self.window = size
+        self.count = 0
+        self._ring = None
+        self._index = 0
+
+    def __len__(self):
+        return min(self.count, self.window)
+
+    def append(self, image):
+        """
+        :param image: SimpleCV image or BGR numpy array
+        """
+        frame = image if isinstance(image, numpy.ndarray) else image.getNumpyCv2()
+        if self._ring is None:
+            self._ring = numpy.zeros((self.window,) + frame.shape, dtype=numpy.uint8)
+
+        self._ring[self._index] = frame
+        self._index = (self._index + 1) % self.window
+        self.count += 1
+
+    def recent(self, count):
+        """
+        :return: numpy array of up to `count` of the newest frames, oldest first
+        """
+        count = min(count, len(self))
+        return self._ring[[(self._index - count + offset) % self.window for offset in range(count)]]
+
+
+class ClipRecorder(object):
+    """
+    Save a short video around each detection: the frames_before frames leading up to it, the detection frame and
+    the frames_after frames that follow.
+
+    Frames aren't copied as they arrive: the recorder reads them back out of a frame window that is being filled
+    anyway (the BackgroundModel's ring in CrowStream), or out of its own preallocated FrameRing if there isn't one.
+    Once a clip's last frame is in, the clip is copied out of the window in one go and handed to a background thread
+    to encode.
+    A detection while a clip is still collecting extends that clip instead of starting another, until the clip fills
+    the frame window; then it closes and a new clip carries on from the detection. At most max_pending clips wait to
+    be encoded; any more are dropped (and counted) before they are copied, so memory stays bounded.
+    """
+
+    def __init__(self, frames_before=15, frames_after=25, frame_rate=5, history=None, max_pending=2, codec="MJPG",
+                 max_frames=None):
+        """
+        :param frames_before: Frames kept from before the detection
+        :param frames_after: Frames recorded after the detection
+        :param frame_rate: Frame rate of the saved clips
+        :param history: Frame window to read frames from (a BackgroundModel in mean or weighted mode, or a FrameRing)
+                        holding at least frames_before + frames_after + 1 frames. A FrameRing is made if not given;
+                        call append() with every frame either way
+        :param max_pending: Number of clips that can wait to be encoded before new ones are dropped
+        :param codec: FourCC code of the clip video codec
+        :param max_frames: Longest a clip can be extended to, which sizes the FrameRing made when there is no history.
+                           Defaults to three clip lengths. Clips from a shared history are limited to its window
+        """
+        self.frames_before = frames_before
+        self.frames_after = frames_after
+        self.frame_rate = frame_rate
+        self.codec = codec
+
+        self.own_history = history is None
+        self.history = history if history is not None else FrameRing(max_frames or 3 * (frames_before + frames_after + 1))
+        if self.history.window < frames_before + frames_after + 1:
+            raise ValueError("The frame window only holds {} frames; clips need {}".format(
+                self.history.window, frames_before + frames_after + 1))
+
+        self.saved_clips = 0
+        self.dropped_clips = 0
+
+        self._collecting = []
+        self._clips = queue.Queue(maxsize=max_pending)
+        self._encoder = threading.Thread(target=self._encode_clips)
+        self._encoder.daemon = True
+        self._encoder.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def trigger(self, path):
+        """
+        Start (or extend) a clip at the current frame. Call before the frame is appended
+        :param path: Video file to save the clip to
+        """
+        remaining = self.frames_after + 1
+
+        # Extend the clip still collecting as far as the frame window allows. If that cuts this detection's
+        # frames short, the clip closes when the window is full and a new one carries on from here
+        if self._collecting:
+            clip = self._collecting[-1]
+            room = self.history.window - clip["frames"]
+            clip["remaining"] = max(clip["remaining"], min(remaining, room))
+            if remaining <= room:
+                return
+
+        self._collecting.append({"path": path, "frames": min(self.frames_before, len(self.history)), "remaining": remaining})
+
+    def append(self, image):
+        """
+        Note the next frame. With a shared frame window, call this after the frame has been added to it
+        :param image: SimpleCV image or BGR numpy array
+        """
+        if self.own_history:
+            self.history.append(image)
+
+        for clip in self._collecting:
+            clip["frames"] += 1
+            clip["remaining"] -= 1
+
+        while self._collecting and self._collecting[0]["remaining"] <= 0:
+            self._finish(self._collecting.pop(0))
+
+    def close(self):
+        """
+        Save any clips still collecting (cut short), encode everything queued and stop the encoder
+        """
+        while self._collecting:
+            self._finish(self._collecting.pop(0))
+
+        self._clips.put((None, None))
+        self._encoder.join()
+
+    def _finish(self, clip):
+        # Only this thread adds clips, so a free slot now is still free below; don't copy a clip that will be dropped
+        if self._clips.full():
+            self.dropped_clips += 1
+            return
+
+        try:
+            self._clips.put_nowait((clip["path"], self.history.recent(clip["frames"])))
+        except queue.Full:
+            self.dropped_clips += 1
+
+    def _encode_clips(self):
+        while True:
+            path, frames = self._clips.get()
+            if path is None:
+                return
+
+            if not len(frames):
+                continue
+
+            try:
+                with METRICS.time("save_clip"):
+                    height, width = frames.shape[1:3]
+                    writer = cv2.VideoWriter(path, _fourcc(self.codec), self.frame_rate, (width, height))
+                    for frame in frames:
+                        writer.write(frame)
+                    writer.release()
+                self.saved_clips += 1
+            except Exception as e:
+                print("Could not save {}: {}".format(path, e))
+
+
+def _fourcc(codec):
+    # OpenCV 2.4 only has the old cv.CV_FOURCC
+    if hasattr(cv2, "VideoWriter_fourcc"):
+        return cv2.VideoWriter_fourcc(*codec)
+
+    return cv2.cv.CV_FOURCC(*codec)
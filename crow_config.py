@@ -5,6 +5,22 @@ OUTPUT_FOLDER = "E:\Downloads\Crow\\"
 EXTENSION = "*.jpg"
 LOG_FILENAME = "TrafficLog.csv"
 
+# Database in OUTPUT_FOLDER with one row per detection, for quick counts over any date range (None = text log only)
+# Query it with crow_store.py, e.g. python crow_store.py TrafficEvents.db counts --start 2015-10-08 --end 2015-10-09
+EVENT_DATABASE = "TrafficEvents.db"
+CAMERA_NAME = "video"  # Camera name the detections are stored under
+
+# Progress record in OUTPUT_FOLDER so reruns skip finished videos and resume partial ones (None = always start over)
+MANIFEST_FILENAME = "manifest.json"
+CHECKPOINT_FRAMES = 1500  # Frames between progress checkpoints
+
+# Video decoding - "ffmpeg" streams raw frames through a pipe, "jpeg" splits the video into TEMP_FOLDER first,
+# "cached" decodes each video once into FRAME_CACHE_FOLDER and reads grayscale frames back from there on reruns
+FRAME_DECODER = "ffmpeg"
+FRAME_CACHE_FOLDER = "E:\TEMP\FrameCache\\"
+FRAME_CACHE_SIZE = 4 * 1024 ** 3  # Bytes of cached frames to keep; least recently used videos are removed first
+FRAME_CACHE_SCALE = 1.0  # Shrink cached frames by this factor. Detection areas and pixel settings are then in scaled pixels
+
 # Detection variables
 THRESHOLD_MINIMUM = 20
 ERODE_ITERATIONS = 3
@@ -12,10 +28,68 @@ DILATE_ITERATIONS = 40
 SMOOTHING_APERTURE = (19, 19)
 MIN_BLOB_SIZE = 30
 
+# Detection zones, each counted separately: a list of {"name": ..., "area": (x, y, w, h)} or the path of a JSON file
+# holding one. None = count the single DETECTION_AREA
+DETECTION_ZONES = None
+DETECTION_AREA = None  # (x, y, w, h) of the detection area. None = drag one on a frame from the first video
+
+# Only process the area around the detection box. Margin is in pixels; None = how far the dilation can spread blobs.
+# Faster, but blobs are clipped to the processed region, so counts can differ for movement at the edges of the area
+DETECTION_ROI = False
+ROI_MARGIN = None
+
+# Dilation engine: "iterative", "kernel", "separable" or "distance" (see crow_morphology). All give the same result
+MORPHOLOGY_ENGINE = "separable"
+
+# Process frames in chunks of this many, smoothing, differencing and thresholding each chunk as one numpy array
+# (0 = one frame pair at a time). Batched runs skip the motion gate; frames with nothing over the threshold are skipped instead
+BATCH_FRAMES = 0
+
+# Motion gate - compare small grayscale thumbnails first and skip the full detector on frames where nothing moved.
+# Faster, but small movers can fall below the thumbnail threshold and be missed, so counts can differ from a run without it
+MOTION_GATE = False
+GATE_SCALE = 8  # Thumbnail downsampling factor
+GATE_PIXEL_THRESHOLD = 10  # Change in a thumbnail pixel that counts as movement
+GATE_MIN_CHANGED = 0.001  # Fraction of thumbnail pixels that must change to run the detector
+
 DETECTION_COOLDOWN = 1.5 # Minimum time between detections in seconds
 
+# How traffic is counted: "cooldown" counts rises in the number of blobs in a zone, limited by DETECTION_COOLDOWN;
+# "tracker" follows blobs between frames and counts each one once per zone it enters
+COUNTING_MODE = "cooldown"
+TRACKER_MAX_DISTANCE = 80  # Furthest a blob can move between frames and still be the same vehicle (pixels)
+TRACKER_MAX_MISSED = 3  # Frames a vehicle can go undetected before its track is dropped
+
 FRAME_RATE = 5  # frames per second
 
+# Batch processing - number of worker processes (1 = one video at a time in this process, None = one per CPU core)
+# Parallel runs always decode with ffmpeg
+PROCESSES = 1
+SEGMENT_SECONDS = None  # Split long videos into segments of this many seconds so they can share the pool
+SEGMENT_OVERLAP_FRAMES = 2  # Frames shared between neighbouring segments so no frame pair is missed
+
+# Per-stage timing. Summary line every METRICS_INTERVAL seconds (0 = off); JSON over HTTP on METRICS_PORT (None = off)
+METRICS_ENABLED = False
+METRICS_INTERVAL = 30
+METRICS_PORT = None
+
 #
 START_TIME = "2015-10-08 9:55:05"
 
+# Settings from a JSON file override the ones above, e.g. {"settings": {"VIDEO_PATH": "/data/video/", "PROCESSES": 4}}
+# The file is named by the CROW_CONFIG environment variable (crow.py sets it), so pool workers load the same settings
+import json as _json
+import os as _os
+
+if _os.environ.get("CROW_CONFIG"):
+    with open(_os.environ["CROW_CONFIG"]) as _config_file:
+        _settings = _json.load(_config_file).get("settings", {})
+
+    for _name, _value in _settings.items():
+        if _name not in globals() or _name.startswith("_"):
+            raise ValueError("Unknown setting '{}' in {}".format(_name, _os.environ["CROW_CONFIG"]))
+        if isinstance(globals()[_name], tuple) and isinstance(_value, list):
+            _value = tuple(_value)
+        elif isinstance(_value, type(u"")) and not isinstance(_value, str):
+            _value = _value.encode("utf-8")  # json gives unicode on python 2
+        globals()[str(_name)] = _value
@@ -0,0 +1,158 @@
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from crow_metrics import METRICS
+
+
+class EventSink(object):
+    """
+    Take motion snapshots and log lines off the detection loop.
+    Images are encoded and saved by a small pool of worker threads fed from a bounded queue; if the queue is full
+    the snapshot is dropped (and counted) rather than making the detector wait.
+    Log lines (and detections for an event store) are buffered in memory and written every flush_interval seconds.
+
+    Call close() (or use it as a context manager) to write out everything still pending.
+    """
+
+    def __init__(self, image_workers=2, max_pending=32, flush_interval=5.0, store=None):
+        """
+        :param image_workers: Number of threads saving images
+        :param max_pending: Number of images that can wait to be saved before new ones are dropped
+        :param flush_interval: Seconds between log flushes (None = only when flush() is called)
+        :param store: crow_store.EventStore for record()ed detections. It is closed along with the sink
+        """
+        self.flush_interval = flush_interval
+        self.store = store
+        self.images = queue.Queue(maxsize=max_pending)
+        self.dropped_images = 0
+        self.saved_images = 0
+
+        self._log_lines = {}
+        self._events = []
+        self._log_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._closed = threading.Event()
+
+        self._workers = []
+        for _ in range(image_workers):
+            worker = threading.Thread(target=self._save_images)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+        self._flusher = threading.Thread(target=self._flush_periodically)
+        self._flusher.daemon = True
+        self._flusher.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def save_image(self, image, path, annotation=None):
+        """
+        Queue an image to be saved
+        :param image: SimpleCV image. Don't draw on it after handing it over
+        :param path: File to save the image to
+        :param annotation: crow_annotation.Annotation to draw on the image just before it is saved
+        :return: True if the image was queued, False if it was dropped
+        """
+        try:
+            self.images.put_nowait((image, path, annotation))
+            return True
+        except queue.Full:
+            self.dropped_images += 1
+            return False
+
+    def log(self, path, line):
+        """
+        Buffer a line to be appended to a log file
+        :param path: Log file
+        :param line: Text to write, including any newline
+        """
+        with self._log_lock:
+            self._log_lines.setdefault(path, []).append(line)
+
+    def record(self, timestamp, zone, camera="", blob_size=None, snapshot=None):
+        """
+        Buffer a detection to be added to the event store. Does nothing without a store
+        :param timestamp: Time of the detection
+        :param zone: Name of the zone
+        :param camera: Name of the camera or recording
+        :param blob_size: Bounding box area of the largest blob in the zone (pixels)
+        :param snapshot: Path of the image saved for the detection, if any
+        """
+        if self.store is None:
+            return
+
+        with self._log_lock:
+            self._events.append((timestamp, camera, zone, blob_size, snapshot))
+
+    def flush(self):
+        """
+        Append all buffered log lines to their files, and add buffered detections to the store in one batch.
+        Flushes run one at a time, so lines stay in order and everything logged before the call is written when it returns
+        """
+        with self._flush_lock:
+            with self._log_lock:
+                pending = self._log_lines
+                events = self._events
+                self._log_lines = {}
+                self._events = []
+
+            with METRICS.time("log_flush"):
+                for path, lines in pending.items():
+                    log_file = open(path, mode='a')
+                    log_file.write("".join(lines))
+                    log_file.close()
+
+            if events:
+                self.store.add(events)
+
+    def close(self, flush=True):
+        """
+        Save every queued image, flush the logs, stop the workers and close the store
+        :param flush: Write out the buffered log lines and detections. False drops them, e.g. when a rerun will redo them
+        """
+        if self._closed.is_set():
+            return
+
+        self._closed.set()
+
+        for _ in self._workers:
+            self.images.put((None, None, None))
+        for worker in self._workers:
+            worker.join()
+
+        self._flusher.join()
+        if flush:
+            self.flush()
+
+        if self.store is not None:
+            self.store.close()
+
+    def _save_images(self):
+        while True:
+            image, path, annotation = self.images.get()
+            if image is None:
+                return
+
+            try:
+                if annotation is not None:
+                    with METRICS.time("draw"):
+                        annotation.render(image)
+
+                with METRICS.time("save_image"):
+                    image.save(path)
+                self.saved_images += 1
+            except Exception as e:
+                print("Could not save {}: {}".format(path, e))
+
+    def _flush_periodically(self):
+        while not self._closed.wait(self.flush_interval):
+            self.flush()
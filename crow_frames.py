@@ -0,0 +1,237 @@
+import glob
+import os
+import subprocess
+
+import numpy
+
+
+class FrameSource(object):
+    """
+    Something that produces video frames in playback order.
+    Subclasses implement arrays(); frames() wraps those into SimpleCV images for the detector.
+    SimpleCV is only imported once frames are wrapped, so probing videos and decoding raw arrays stays light.
+    """
+
+    def arrays(self):
+        """
+        Yield raw frames as BGR numpy arrays (height, width, 3).
+        The arrays may be reused buffers - copy them if they need to outlive the next few frames.
+        """
+        raise NotImplementedError
+
+    def frames(self):
+        """
+        Yield frames as SimpleCV images
+        """
+        from SimpleCV import Image
+
+        for array in self.arrays():
+            yield Image(array, cv2image=True)
+
+    def __iter__(self):
+        return self.frames()
+
+
+class FFmpegFrameSource(FrameSource):
+    """
+    Decode a video through an ffmpeg pipe.
+    Raw frames are read straight into a small ring of preallocated buffers, so nothing touches the disk
+    and memory use stays at a few frames regardless of video length.
+    """
+
+    def __init__(self, video_path, frame_rate=5, buffers=3, ffmpeg="ffmpeg", ffprobe="ffprobe", start=0, length=None):
+        """
+        :param video_path: Path of the video to decode
+        :param frame_rate: Rate that frames are sampled from the video (frames per second)
+        :param buffers: Number of frame buffers to rotate through. Yielded arrays stay valid for buffers - 1 frames
+        :param ffmpeg: ffmpeg executable
+        :param ffprobe: ffprobe executable
+        :param start: Offset into the video to start decoding from (seconds)
+        :param length: Amount of video to decode (seconds), or None to decode to the end
+        """
+        self.video_path = video_path
+        self.frame_rate = frame_rate
+        self.start = start
+        self.length = length
+        self.buffers = max(buffers, 2)
+        self.ffmpeg = ffmpeg
+        self.ffprobe = ffprobe
+
+        self.width = None
+        self.height = None
+        self.duration = None
+
+    def probe(self):
+        """
+        Read the frame size and duration of the video
+        :return: width, height, duration (seconds)
+        """
+        if self.width is None:
+            output = subprocess.check_output([self.ffprobe, "-v", "error", "-select_streams", "v:0",
+                                              "-show_entries", "stream=width,height:format=duration",
+                                              "-of", "default=noprint_wrappers=1", self.video_path])
+            info = dict(line.strip().split("=", 1) for line in output.decode().splitlines() if "=" in line)
+            self.width = int(info["width"])
+            self.height = int(info["height"])
+
+            try:
+                self.duration = float(info["duration"])
+            except (KeyError, ValueError):
+                self.duration = 0.0
+
+        return self.width, self.height, self.duration
+
+    def _decode(self, extra_input_args=(), extra_output_args=()):
+        width, height, duration = self.probe()
+        frame_bytes = width * height * 3
+
+        command = [self.ffmpeg, "-v", "error"]
+        command.extend(extra_input_args)
+        command.extend(["-i", self.video_path, "-r", str(self.frame_rate)])
+        command.extend(extra_output_args)
+        command.extend(["-f", "rawvideo", "-pix_fmt", "bgr24", "-"])
+
+        ring = [numpy.empty(frame_bytes, dtype=numpy.uint8) for _ in range(self.buffers)]
+        pipe = subprocess.Popen(command, stdout=subprocess.PIPE, bufsize=frame_bytes)
+
+        try:
+            index = 0
+            while True:
+                buffer = ring[index]
+                if not _read_exact(pipe.stdout, buffer):
+                    break
+
+                yield buffer.reshape(height, width, 3)
+                index = (index + 1) % self.buffers
+
+        finally:
+            pipe.stdout.close()
+            if pipe.poll() is None:
+                pipe.kill()
+            pipe.wait()
+
+    def arrays(self):
+        seek = ["-ss", "{:.3f}".format(self.start)] if self.start else []
+        length = ["-t", "{:.3f}".format(self.length)] if self.length is not None else []
+        return self._decode(extra_input_args=seek, extra_output_args=length)
+
+    def sample_frame(self, position=0.5):
+        """
+        Decode a single frame part way through the video
+        :param position: Fraction of the way through the video to take the frame from
+        :return: SimpleCV image of the frame
+        """
+        from SimpleCV import Image
+
+        width, height, duration = self.probe()
+        seek = ["-ss", "{:.3f}".format(duration * position)] if duration else []
+
+        for array in self._decode(extra_input_args=seek, extra_output_args=["-frames:v", "1"]):
+            return Image(array.copy(), cv2image=True)
+
+
+class JpegFrameSource(FrameSource):
+    """
+    Legacy decoder: split the video into JPEG files in a temp folder, then load them back one at a time.
+    Each file is removed once it has been read.
+    """
+
+    def __init__(self, video_path, frame_rate=5, temp_folder="", extension="*.jpg", ffmpeg="ffmpeg"):
+        self.video_path = video_path
+        self.temp_folder = temp_folder
+        self.frame_rate = frame_rate
+        self.extension = extension
+        self.ffmpeg = ffmpeg
+
+    def _split(self):
+        name = os.path.split(self.video_path)[-1].split('.')[0]
+        output = os.path.join(self.temp_folder, "{}%04d.jpg".format(name))
+        subprocess.check_output([self.ffmpeg, "-v", "error", "-y", "-i", self.video_path, "-r", str(self.frame_rate), output])
+        return sorted(glob.glob(os.path.join(self.temp_folder, name + self.extension)))
+
+    def frames(self):
+        from SimpleCV import Image
+
+        image_files = self._split()
+
+        try:
+            for image_file in image_files:
+                image = Image(image_file)
+                os.remove(image_file)
+                yield image
+
+        finally:
+            for image_file in image_files:
+                if os.path.exists(image_file):
+                    os.remove(image_file)
+
+    def arrays(self):
+        for image in self.frames():
+            yield image.getNumpyCv2()
+
+    def sample_frame(self, position=0.5):
+        from SimpleCV import Image
+
+        image_files = self._split()
+        image = Image(image_files[int(len(image_files) * position)])
+
+        for image_file in image_files:
+            os.remove(image_file)
+
+        return image
+
+
+class ImageFileSource(FrameSource):
+    """
+    Frames from a list of image files already on disk
+    """
+
+    def __init__(self, image_files):
+        self.image_files = image_files
+
+    def frames(self):
+        from SimpleCV import Image
+
+        for image_file in self.image_files:
+            yield Image(image_file)
+
+    def arrays(self):
+        for image in self.frames():
+            yield image.getNumpyCv2()
+
+
+FRAME_DECODERS = {
+    "ffmpeg": FFmpegFrameSource,
+    "jpeg": JpegFrameSource,
+}
+
+
+def open_video(video_path, decoder="ffmpeg", **kwargs):
+    """
+    Open a video with one of the registered decoders
+    :param video_path: Path of the video to decode
+    :param decoder: Name of the decoder in FRAME_DECODERS, or a FrameSource class
+    :param kwargs: Extra arguments for the decoder
+    :return: FrameSource for the video
+    """
+    if isinstance(decoder, str):
+        decoder = FRAME_DECODERS[decoder]
+
+    return decoder(video_path, **kwargs)
+
+
+def _read_exact(stream, buffer):
+    """
+    Fill a buffer from a stream
+    :return: True if the buffer was filled, False if the stream ended first
+    """
+    view = memoryview(buffer)
+    filled = 0
+
+    while filled < len(view):
+        count = stream.readinto(view[filled:])
+        if not count:
+            return False
+        filled += count
+
+    return True
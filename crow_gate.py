@@ -0,0 +1,82 @@
+import cv2
+import numpy
+
+
+class MotionGate(object):
+    """
+    Cheap check for whether anything moved between two frames, run before the full detector.
+    Both frames are shrunk to grayscale thumbnails; if too few thumbnail pixels changed, the pair is reported as
+    static and the smoothing, morphology and blob finding can be skipped.
+
+    The thumbnail of the last 'after' frame is kept, so a frame that comes back as the next 'before' frame
+    is only shrunk once.
+    """
+
+    def __init__(self, scale=8, pixel_threshold=10, min_changed=0.001):
+        """
+        :param scale: Downsampling factor for the thumbnails
+        :param pixel_threshold: Change in a thumbnail pixel's value that counts as movement
+        :param min_changed: Fraction of thumbnail pixels that must change for the pair to go through the detector
+        """
+        self.scale = max(int(scale), 1)
+        self.pixel_threshold = pixel_threshold
+        self.min_changed = min_changed
+
+        self.checked = 0
+        self.skipped = 0
+
+        self._last_image = None
+        self._last_thumbnail = None
+
+    def thumbnail(self, image):
+        """
+        :param image: SimpleCV image or numpy array
+        :return: Downsampled grayscale numpy array
+        """
+        if isinstance(image, numpy.ndarray):
+            gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        else:
+            gray = image.getGrayNumpyCv2()
+
+        if self.scale == 1:
+            return gray
+
+        height, width = gray.shape[:2]
+        size = (max(width // self.scale, 1), max(height // self.scale, 1))
+        return cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+
+    def _get_thumbnail(self, image):
+        if image is self._last_image:
+            return self._last_thumbnail
+
+        return self.thumbnail(image)
+
+    def has_motion(self, before_image, after_image):
+        """
+        :param before_image: 'Background' frame
+        :param after_image: Movement frame
+        :return: True if enough changed for the full detector to run
+        """
+        before = self._get_thumbnail(before_image)
+        after = self._get_thumbnail(after_image)
+
+        self._last_image = after_image
+        self._last_thumbnail = after
+
+        changed = numpy.count_nonzero(cv2.absdiff(before, after) > self.pixel_threshold)
+        moving = changed > 0 and changed >= self.min_changed * after.size
+
+        self.checked += 1
+        if not moving:
+            self.skipped += 1
+
+        return moving
+
+    def skip_rate(self):
+        """
+        :return: Fraction of frame pairs that were skipped
+        """
+        return self.skipped / float(self.checked) if self.checked else 0.0
+
+    def summary(self):
+        return "Motion gate skipped {} of {} frames ({:.1%})".format(self.skipped, self.checked, self.skip_rate())
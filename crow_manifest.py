@@ -0,0 +1,107 @@
+import datetime
+import json
+import os
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+
+class Manifest(object):
+    """
+    Record of how far each video has been processed, so a rerun can skip finished videos,
+    resume partial ones from their last checkpoint and only start fresh on new recordings.
+
+    Videos are identified by path, size and modification time; a video that has changed since it was
+    recorded in the manifest is treated as new. Run-wide settings (like the detection area) go in `settings`
+    so a rerun counts the same way.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: Manifest file. It doesn't need to exist yet
+        """
+        self.path = path
+        self.videos = {}
+        self.settings = {}
+
+    @classmethod
+    def load(cls, path):
+        manifest = cls(path)
+
+        if os.path.exists(path):
+            with open(path) as manifest_file:
+                contents = json.load(manifest_file)
+
+            manifest.videos = contents.get("videos", {})
+            manifest.settings = contents.get("settings", {})
+
+        return manifest
+
+    def save(self):
+        """
+        Write the manifest out. The old file is only replaced once the new one is complete
+        """
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as manifest_file:
+            json.dump({"settings": self.settings, "videos": self.videos}, manifest_file, indent=2, sort_keys=True)
+
+        if os.name == "nt" and os.path.exists(self.path):
+            os.remove(self.path)
+        os.rename(temp_path, self.path)
+
+    def lookup(self, video):
+        """
+        :param video: Video path
+        :return: Manifest entry for the video, or None if it is new or has changed since it was recorded
+        """
+        entry = self.videos.get(video)
+        if entry is None:
+            return None
+
+        stat = os.stat(video)
+        if entry["size"] != stat.st_size or entry["mtime"] != stat.st_mtime:
+            return None
+
+        return entry
+
+    def is_done(self, video):
+        entry = self.lookup(video)
+        return entry is not None and entry["status"] == "done"
+
+    def begin(self, video, start_time):
+        """
+        Start a fresh entry for a video
+        :param start_time: Time of the first frame of the video
+        """
+        stat = os.stat(video)
+        self.videos[video] = {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "status": "partial",
+            "frames": 0,
+            "start_time": start_time.strftime(TIME_FORMAT),
+            "next_start_time": None,
+        }
+
+    def checkpoint(self, video, frames):
+        """
+        Record that the first `frames` frames of a video have been processed and logged
+        """
+        self.videos[video]["frames"] = frames
+
+    def finish(self, video, frames, next_start_time):
+        """
+        Mark a video as done
+        :param frames: Total number of frames in the video
+        :param next_start_time: Start time carried on to the following video
+        """
+        entry = self.videos[video]
+        entry["status"] = "done"
+        entry["frames"] = frames
+        entry["next_start_time"] = next_start_time.strftime(TIME_FORMAT)
+
+    def get_time(self, video, key):
+        """
+        :param key: "start_time" or "next_start_time"
+        :return: Time from the video's entry as a datetime
+        """
+        return datetime.datetime.strptime(self.videos[video][key], TIME_FORMAT)
@@ -0,0 +1,236 @@
+import bisect
+import collections
+import json
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+
+class Histogram(object):
+    """
+    Latency histogram with fixed exponential buckets, so recording a sample is O(1) and memory never grows
+    """
+
+    # 0.05 ms up to about 30 s, each bucket 1.5x the last
+    BOUNDS = [0.00005 * 1.5 ** i for i in range(34)]
+
+    def __init__(self):
+        self.buckets = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.buckets[bisect.bisect_left(self.BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, fraction):
+        """
+        :param fraction: Percentile as a fraction, e.g. 0.9
+        :return: Upper bound of the bucket the percentile falls in (seconds)
+        """
+        if not self.count:
+            return 0.0
+
+        target = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= target:
+                return self.BOUNDS[index] if index < len(self.BOUNDS) else self.max
+
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean_ms": 1000.0 * self.total / self.count if self.count else 0.0,
+            "p50_ms": 1000.0 * self.percentile(0.5),
+            "p90_ms": 1000.0 * self.percentile(0.9),
+            "p99_ms": 1000.0 * self.percentile(0.99),
+            "max_ms": 1000.0 * self.max,
+        }
+
+
+class _Timer(object):
+    __slots__ = ("metrics", "stage", "start")
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.record(self.stage, time.time() - self.start)
+
+
+class _NullTimer(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Metrics(object):
+    """
+    Per-stage timings, counters and gauges for the detection pipeline.
+    While disabled, time() hands back a shared do-nothing context manager and the other calls return straight away,
+    so the instrumentation can stay in the hot path.
+
+        with METRICS.time("dilate"):
+            ...
+    """
+
+    def __init__(self, enabled=False, fps_window=100):
+        self.enabled = enabled
+        self.started = time.time()
+
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self._frame_times = collections.deque(maxlen=fps_window)
+        self._lock = threading.Lock()
+
+    def time(self, stage):
+        """
+        :param stage: Name of the stage being timed
+        :return: Context manager that records the time spent inside it
+        """
+        if not self.enabled:
+            return _NULL_TIMER
+
+        return _Timer(self, stage)
+
+    def record(self, stage, seconds):
+        if not self.enabled:
+            return
+
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.record(seconds)
+
+    def increment(self, counter, amount=1):
+        if not self.enabled:
+            return
+
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def mark_frame(self):
+        """
+        Count a processed frame, for the frame rate
+        """
+        if not self.enabled:
+            return
+
+        self._frame_times.append(time.time())
+        self.increment("frames")
+
+    def register_gauge(self, name, function):
+        """
+        Add a value that is read whenever the metrics are reported, e.g. a queue depth
+        :param name: Name of the gauge
+        :param function: Function returning the current value
+        """
+        self.gauges[name] = function
+
+    def fps(self):
+        frame_times = list(self._frame_times)
+        if len(frame_times) < 2 or frame_times[-1] == frame_times[0]:
+            return 0.0
+
+        return (len(frame_times) - 1) / (frame_times[-1] - frame_times[0])
+
+    def snapshot(self):
+        """
+        :return: Dictionary of everything recorded so far
+        """
+        with self._lock:
+            stages = dict((stage, histogram.summary()) for stage, histogram in self.histograms.items())
+            counters = dict(self.counters)
+
+        return {
+            "uptime": time.time() - self.started,
+            "fps": self.fps(),
+            "counters": counters,
+            "gauges": dict((name, function()) for name, function in self.gauges.items()),
+            "stages": stages,
+        }
+
+    def summary_line(self):
+        """
+        :return: One line summary: frame rate, gauges, then the p50 of each stage
+        """
+        snapshot = self.snapshot()
+
+        parts = ["{:.1f} fps".format(snapshot["fps"])]
+        parts.extend("{} {}".format(name, value) for name, value in sorted(snapshot["gauges"].items()))
+        parts.extend("{} {}".format(name, value) for name, value in sorted(snapshot["counters"].items()))
+        parts.extend("{} {:.1f}ms".format(stage, stats["p50_ms"]) for stage, stats in sorted(snapshot["stages"].items()))
+
+        return " | ".join(parts)
+
+
+# Shared metrics for the whole process. Scripts switch it on with METRICS.enabled = True
+METRICS = Metrics()
+
+
+def start_summary_reporter(metrics=METRICS, interval=30):
+    """
+    Print a summary line every `interval` seconds on a background thread
+    """
+    def report():
+        while True:
+            time.sleep(interval)
+            print(metrics.summary_line())
+
+    reporter = threading.Thread(target=report)
+    reporter.daemon = True
+    reporter.start()
+    return reporter
+
+
+def start_metrics_server(metrics=METRICS, port=8321, host="127.0.0.1"):
+    """
+    Serve the metrics as JSON over HTTP on a background thread (GET / or /metrics)
+    :return: The HTTP server; call shutdown() to stop it
+    """
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+
+            body = json.dumps(metrics.snapshot(), indent=2, sort_keys=True).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = HTTPServer((host, port), MetricsHandler)
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+    return server
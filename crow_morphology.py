@@ -0,0 +1,98 @@
+import sys
+
+import cv2
+import numpy
+
+# iterative - repeated 3x3 dilations, the original SimpleCV behaviour. Cost grows with the iteration count
+# kernel    - one dilation with a (2n + 1) square kernel
+# separable - the same square kernel split into a horizontal and a vertical line pass
+# distance  - chessboard distance transform threshold. Binary images only, cost doesn't depend on n at all
+MORPHOLOGY_ENGINES = ("iterative", "kernel", "separable", "distance")
+
+# OpenCV 2.4 (what SimpleCV runs on) only has the old cv.CV_DIST_C name
+_DIST_C = cv2.DIST_C if hasattr(cv2, "DIST_C") else cv2.cv.CV_DIST_C
+
+
+def dilate_array(array, iterations, engine="separable"):
+    """
+    Dilate a grayscale array as if by `iterations` passes of a 3x3 square kernel.
+    n passes of a 3x3 square are exactly one pass of a (2n + 1) square, which is what the fast engines use.
+
+    :param array: 2D uint8 numpy array. Must be binary (0/255) for the distance engine
+    :param iterations: Number of equivalent 3x3 dilations
+    :param engine: One of MORPHOLOGY_ENGINES
+    :return: Dilated array
+    """
+    if iterations <= 0:
+        return array.copy()
+
+    size = 2 * iterations + 1
+
+    if engine == "iterative":
+        return cv2.dilate(array, numpy.ones((3, 3), numpy.uint8), iterations=iterations)
+
+    elif engine == "kernel":
+        return cv2.dilate(array, cv2.getStructuringElement(cv2.MORPH_RECT, (size, size)))
+
+    elif engine == "separable":
+        horizontal = cv2.dilate(array, numpy.ones((1, size), numpy.uint8))
+        return cv2.dilate(horizontal, numpy.ones((size, 1), numpy.uint8))
+
+    elif engine == "distance":
+        # Distance from every background pixel to the nearest foreground pixel
+        background = numpy.where(array > 0, 0, 255).astype(numpy.uint8)
+        distance = cv2.distanceTransform(background, _DIST_C, 3)
+        return numpy.where(distance <= iterations, 255, 0).astype(numpy.uint8)
+
+    raise ValueError("Unknown morphology engine '{}'. Use one of: {}".format(engine, ", ".join(MORPHOLOGY_ENGINES)))
+
+
+def dilate_image(image, iterations, engine="separable"):
+    """
+    Dilate a SimpleCV image with the selected engine
+    :param image: SimpleCV image (thresholded for the distance engine)
+    :param iterations: Number of equivalent 3x3 dilations
+    :param engine: One of MORPHOLOGY_ENGINES
+    :return: Dilated SimpleCV image
+    """
+    if engine == "iterative":
+        return image.dilate(iterations=iterations)
+
+    from SimpleCV import Image
+
+    dilated = dilate_array(image.getGrayNumpyCv2(), iterations, engine)
+    return Image(cv2.cvtColor(dilated, cv2.COLOR_GRAY2BGR), cv2image=True)
+
+
+def check_dilation(image, iterations, threshold=128, engines=MORPHOLOGY_ENGINES):
+    """
+    Compare the fast engines against the original iterative SimpleCV dilation
+    :param image: SimpleCV image to threshold and dilate
+    :param iterations: Number of dilations
+    :param threshold: Threshold used to turn the image into a binary mask before dilating
+    :param engines: Engines to check
+    :return: Dictionary of engine name: number of pixels that differ from the iterative result
+    """
+    binary = image.threshold(threshold)
+    expected = binary.dilate(iterations=iterations).getGrayNumpyCv2()
+
+    mismatches = {}
+    for engine in engines:
+        result = dilate_image(binary, iterations, engine).getGrayNumpyCv2()
+        mismatches[engine] = int(numpy.count_nonzero(result != expected))
+
+    return mismatches
+
+
+if __name__ == '__main__':
+    from SimpleCV import Image
+
+    image_file = sys.argv[1] if len(sys.argv) > 1 else "test.jpg"
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+
+    mismatches = check_dilation(Image(image_file), iterations)
+
+    for engine in MORPHOLOGY_ENGINES:
+        print("{:10} {}".format(engine, "OK" if mismatches[engine] == 0 else "{} pixels differ".format(mismatches[engine])))
+
+    sys.exit(1 if any(mismatches.values()) else 0)
@@ -0,0 +1,158 @@
+import datetime
+import math
+import multiprocessing
+
+from crow_frames import FFmpegFrameSource
+
+
+def get_start_times(videos, start_time, frame_rate=5):
+    """
+    Work out the start time of every video up front, the same way the serial loop accumulates them
+    :param videos: List of video paths, in recording order
+    :param start_time: Start time of the first video
+    :param frame_rate: Rate that frames are sampled from the videos
+    :return: List of (start time, duration in seconds) for each video
+    """
+    times = []
+
+    for video in videos:
+        width, height, duration = FFmpegFrameSource(video, frame_rate=frame_rate).probe()
+        times.append((start_time, duration))
+
+        frame_count = int(round(duration * frame_rate))
+        start_time += datetime.timedelta(seconds=(frame_count / frame_rate) - 1)
+
+    return times
+
+
+def build_tasks(videos, start_times, frame_rate=5, segment_seconds=None, overlap_frames=2):
+    """
+    Split the videos into jobs for the worker pool.
+    Segments after the first in each video start a few frames early, so the frame pairs that straddle a
+    segment boundary are still compared. Those overlap frames only prime the detector and are not counted.
+
+    :param videos: List of video paths
+    :param start_times: List of (start time, duration) from get_start_times
+    :param frame_rate: Rate that frames are sampled from the videos
+    :param segment_seconds: Length of each segment, or None to process whole videos
+    :param overlap_frames: Number of frames shared with the previous segment
+    :return: List of task dictionaries for process_segment
+    """
+    tasks = []
+
+    for video, (start_time, duration) in zip(videos, start_times):
+        if not segment_seconds or duration <= segment_seconds:
+            segments = 1
+        else:
+            segments = int(math.ceil(duration / float(segment_seconds)))
+
+        for segment in range(segments):
+            start = 0.0
+            length = None
+            warmup = 0
+
+            if segments > 1:
+                start = segment * segment_seconds
+                length = segment_seconds if segment < segments - 1 else None
+
+                if segment > 0:
+                    overlap = overlap_frames / float(frame_rate)
+                    start -= overlap
+                    length = length + overlap if length is not None else None
+                    warmup = overlap_frames
+
+            tasks.append({
+                "video": video,
+                "start": start,
+                "length": length,
+                "timestamp": start_time + datetime.timedelta(seconds=start),
+                "warmup": warmup,
+                "frame_rate": frame_rate,
+            })
+
+    return tasks
+
+
+def process_segment(task):
+    """
+    Worker: run the detector over one video segment
+    :param task: Task dictionary from build_tasks, plus the output settings
+    :return: List of (timestamp, zone name, blob size, snapshot path) detections
+    """
+    from CarCrow import find_traffic
+
+    frame_source = FFmpegFrameSource(task["video"], frame_rate=task["frame_rate"], start=task["start"],
+                                     length=task["length"])
+
+    frame_count, detections = find_traffic(frame_source, timestamp=task["timestamp"],
+                                           output_path=task["output_path"],
+                                           detection_area=task["detection_area"],
+                                           zones=task["zones"],
+                                           output_images=task["output_images"],
+                                           output_log=False,
+                                           warmup_frames=task["warmup"])
+    return detections
+
+
+def apply_cooldown(detections, cooldown):
+    """
+    Drop detections closer than the cooldown to the previous one in the same zone.
+    Each worker already applies the cooldown; this catches repeats across segment boundaries.
+
+    :param detections: Sorted list of detections, each starting with timestamp and zone name
+    :param cooldown: Minimum time between detections in seconds
+    :return: Filtered list of detections
+    """
+    kept = []
+    last_times = {}
+
+    for detection in detections:
+        timestamp, zone = detection[:2]
+        last_time = last_times.get(zone)
+        if last_time is None or (timestamp - last_time).total_seconds() > cooldown:
+            kept.append(detection)
+            last_times[zone] = timestamp
+
+    return kept
+
+
+def process_videos(videos, start_time, detection_area, output_path="", output_images=True, processes=None,
+                   frame_rate=5, segment_seconds=None, overlap_frames=2, cooldown=0, zones=None, start_times=None):
+    """
+    Run the detector over a batch of videos on a pool of worker processes
+    :param videos: List of video paths, in recording order
+    :param start_time: Start time of the first video
+    :param detection_area: Tuple containing x, y, w, h of the detection area
+    :param output_path: Prefix for saved motion images
+    :param output_images: Save an annotated image for each detection
+    :param processes: Number of worker processes. Defaults to the number of CPU cores
+    :param frame_rate: Rate that frames are sampled from the videos
+    :param segment_seconds: Split videos into segments of this length, or None to process whole videos
+    :param overlap_frames: Number of frames shared between neighbouring segments
+    :param cooldown: Minimum time between detections in seconds (0 = keep every detection, e.g. when tracking)
+    :param zones: ZoneSet to count instead of the single detection area
+    :param start_times: Start times from get_start_times, if already known. start_time is ignored if given
+    :return: Sorted list of (timestamp, zone name, blob size, snapshot path) detections across all videos
+    """
+    if start_times is None:
+        start_times = get_start_times(videos, start_time, frame_rate)
+    tasks = build_tasks(videos, start_times, frame_rate, segment_seconds, overlap_frames)
+
+    for task in tasks:
+        task["detection_area"] = detection_area
+        task["zones"] = zones
+        task["output_path"] = output_path
+        task["output_images"] = output_images
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = pool.map(process_segment, tasks, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+    detections = sorted(detection for result in results for detection in result)
+    if not cooldown:
+        return detections
+
+    return apply_cooldown(detections, cooldown)
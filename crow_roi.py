@@ -0,0 +1,104 @@
+def get_roi_margin(dilates=40, smooth_aperture=(19, 19), erodes=3):
+    """
+    Work out how far movement outside the detection area can spread into it during feature extraction.
+    Erosion treats pixels past the crop edge as foreground, so it can leave up to erodes pixels along the edge that a
+    full frame would have eroded away. Each dilation then grows that by a pixel, the final blur by half its aperture
+    and the initial smooth by one more.
+    :return: Margin in pixels
+    """
+    return erodes + dilates + max(smooth_aperture) // 2 + 1
+
+
+def get_roi(detection_area, image_size, margin=0):
+    """
+    Get the region of an image that needs to be processed for a detection area
+    :param detection_area: Tuple containing x, y, w, h of the detection area
+    :param image_size: Tuple containing width, height of the full frame
+    :param margin: Extra pixels to keep around the detection area
+    :return: Tuple containing x, y, w, h of the region, clipped to the frame, or None if the area is not usable
+    """
+    if detection_area is None or None in detection_area:
+        return None
+
+    x, y, w, h = detection_area
+    if w <= 0 or h <= 0:
+        return None
+
+    width, height = image_size
+    xmin = max(x - margin, 0)
+    ymin = max(y - margin, 0)
+    xmax = min(x + w + margin, width)
+    ymax = min(y + h + margin, height)
+
+    if xmax <= xmin or ymax <= ymin:
+        return None
+
+    return xmin, ymin, xmax - xmin, ymax - ymin
+
+
+def crop_to_roi(image, roi):
+    """
+    :param image: SimpleCV image
+    :param roi: Tuple containing x, y, w, h of the region
+    :return: Cropped image
+    """
+    return image.crop(roi[0], roi[1], roi[2], roi[3])
+
+
+class OffsetBlob(object):
+    """
+    A blob found in a cropped image, reporting its position in full-frame coordinates.
+    Position methods are shifted by the crop offset; everything else (size, area, etc.) is passed through.
+    Blobs that ran off the edge of the crop are clipped to it.
+    """
+
+    def __init__(self, blob, dx, dy):
+        self.blob = blob
+        self.dx = dx
+        self.dy = dy
+        self.x = blob.x + dx
+        self.y = blob.y + dy
+
+    def __getattr__(self, name):
+        return getattr(self.blob, name)
+
+    def minX(self):
+        return self.blob.minX() + self.dx
+
+    def maxX(self):
+        return self.blob.maxX() + self.dx
+
+    def minY(self):
+        return self.blob.minY() + self.dy
+
+    def maxY(self):
+        return self.blob.maxY() + self.dy
+
+    def centroid(self):
+        cx, cy = self.blob.centroid()
+        return cx + self.dx, cy + self.dy
+
+    def coordinates(self):
+        return self.x, self.y
+
+    def topLeftCorner(self):
+        return self.minX(), self.minY()
+
+    def bottomRightCorner(self):
+        return self.maxX(), self.maxY()
+
+    def boundingBox(self):
+        return self.minX(), self.minY(), self.blob.width(), self.blob.height()
+
+
+def offset_features(features, roi):
+    """
+    Map blobs found inside a region back to full-frame coordinates
+    :param features: Feature set from findBlobs on the cropped image (may be None)
+    :param roi: Tuple containing x, y, w, h of the region the blobs were found in
+    :return: List of OffsetBlobs, or None if there were no features
+    """
+    if features is None:
+        return None
+
+    return [OffsetBlob(blob, roi[0], roi[1]) for blob in features]
@@ -0,0 +1,229 @@
+"""
+Detections kept in a local SQLite database, so traffic counts over any date range come from an index
+instead of re-reading the text logs.
+
+    python crow_store.py events.db counts --start 2015-10-01 --end 2015-11-01 --bin hour
+    python crow_store.py events.db import "2015-10 CrowLog.log" --camera webcam
+"""
+import argparse
+import calendar
+import datetime
+import re
+import sqlite3
+import sys
+import threading
+
+from crow_metrics import METRICS
+
+# Bin sizes that can be named on the command line (seconds)
+BIN_SIZES = {
+    "minute": 60,
+    "15min": 15 * 60,
+    "hour": 60 * 60,
+    "day": 24 * 60 * 60,
+    "week": 7 * 24 * 60 * 60,
+}
+
+# A detection in a CrowStream log: timestamp, then the zones that fired if there is more than one
+LOG_ENTRY = re.compile(r"(\d{4}-\d{2}-\d{2} \d{2}\.\d{2}\.\d{2})(?:,([^\n]*))?")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    time REAL NOT NULL,
+    camera TEXT NOT NULL,
+    zone TEXT NOT NULL,
+    blob_size INTEGER,
+    snapshot TEXT
+);
+CREATE INDEX IF NOT EXISTS events_time ON events (time, zone, camera);
+CREATE INDEX IF NOT EXISTS events_zone ON events (zone, time);
+"""
+
+
+def to_seconds(timestamp):
+    """
+    Detection times are local wall-clock times with no zone, so they are stored as seconds since 1970 as if they
+    were UTC. That keeps every day 86400 seconds long and hour/day bins line up with the clock
+    :param timestamp: datetime
+    :return: Seconds
+    """
+    return calendar.timegm(timestamp.timetuple()) + timestamp.microsecond / 1e6
+
+
+def from_seconds(seconds):
+    """
+    :return: datetime for a stored time
+    """
+    return datetime.datetime(1970, 1, 1) + datetime.timedelta(seconds=seconds)
+
+
+class EventStore(object):
+    """
+    One row per detection: time, camera, zone, size of the largest blob in the zone and the snapshot saved for it.
+    Rows are indexed by time (covering zone and camera too, so counts never touch the table) and by zone, so binned
+    counts over a date range only read the rows in that range however many years are stored.
+
+    Rows are written in batches with add(); EventSink buffers them and adds them on each flush.
+    The connection can be shared between threads.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: Database file. Created if it doesn't exist
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+
+        # Readers (the counts CLI) don't block the detector while it writes
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add(self, events):
+        """
+        Insert a batch of detections in one transaction
+        :param events: Iterable of (timestamp, camera, zone, blob size, snapshot path) tuples. Blob size and snapshot may be None
+        :return: Number of rows added
+        """
+        rows = [(to_seconds(timestamp), camera, zone, None if blob_size is None else int(blob_size), snapshot)
+                for timestamp, camera, zone, blob_size, snapshot in events]
+        if not rows:
+            return 0
+
+        with METRICS.time("store"):
+            with self._lock:
+                with self._connection:
+                    self._connection.executemany("INSERT INTO events (time, camera, zone, blob_size, snapshot) VALUES (?, ?, ?, ?, ?)", rows)
+
+        return len(rows)
+
+    def counts(self, start, end, bin_size=3600, zone=None, camera=None):
+        """
+        Number of detections in each time bin and zone
+        :param start: Start of the first bin (datetime)
+        :param end: End of the range, exclusive (datetime)
+        :param bin_size: Bin length in seconds, or a name from BIN_SIZES
+        :param zone: Only count this zone
+        :param camera: Only count this camera
+        :return: List of (bin start, zone, count), in time order. Empty bins are left out
+        """
+        bin_size = BIN_SIZES.get(bin_size, bin_size)
+        origin = to_seconds(start)
+
+        query = "SELECT CAST((time - ?) / ? AS INTEGER) AS bin, zone, COUNT(*) FROM events WHERE time >= ? AND time < ?"
+        parameters = [origin, bin_size, origin, to_seconds(end)]
+
+        if zone is not None:
+            query += " AND zone = ?"
+            parameters.append(zone)
+        if camera is not None:
+            query += " AND camera = ?"
+            parameters.append(camera)
+
+        query += " GROUP BY bin, zone ORDER BY bin, zone"
+
+        with self._lock:
+            rows = self._connection.execute(query, parameters).fetchall()
+
+        return [(start + datetime.timedelta(seconds=index * bin_size), zone_name, count) for index, zone_name, count in rows]
+
+    def events(self, start, end, zone=None, camera=None):
+        """
+        :return: List of (timestamp, camera, zone, blob size, snapshot) detections in a date range, in time order
+        """
+        query = "SELECT time, camera, zone, blob_size, snapshot FROM events WHERE time >= ? AND time < ?"
+        parameters = [to_seconds(start), to_seconds(end)]
+
+        if zone is not None:
+            query += " AND zone = ?"
+            parameters.append(zone)
+        if camera is not None:
+            query += " AND camera = ?"
+            parameters.append(camera)
+
+        with self._lock:
+            rows = self._connection.execute(query + " ORDER BY time", parameters).fetchall()
+
+        return [(from_seconds(row[0]),) + tuple(row[1:]) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def read_stream_log(log_file, zone="detection_area"):
+    """
+    Pull the detections out of a CrowStream log. Older logs ran the entries together with no newlines
+    :param log_file: Open log file
+    :param zone: Zone name for entries that don't list their zones
+    :return: Generator of (timestamp, zone) detections
+    """
+    for match in LOG_ENTRY.finditer(log_file.read()):
+        timestamp = datetime.datetime.strptime(match.group(1), '%Y-%m-%d %H.%M.%S')
+        for name in (match.group(2) or zone).split(";"):
+            yield timestamp, name
+
+
+def parse_date(text):
+    """
+    :param text: "YYYY-MM-DD" or "YYYY-MM-DD HH:MM"
+    :return: datetime
+    """
+    for date_format in ('%Y-%m-%d %H:%M', '%Y-%m-%d'):
+        try:
+            return datetime.datetime.strptime(text, date_format)
+        except ValueError:
+            pass
+
+    raise argparse.ArgumentTypeError("Dates look like 2015-10-08 or '2015-10-08 09:00', not '{}'".format(text))
+
+
+def main(argv=None):
+    """
+    Print binned traffic counts, or load old CrowStream logs into the database
+    :param argv: Command line arguments (default: sys.argv)
+    """
+    parser = argparse.ArgumentParser(description='Query and fill the traffic event database')
+    parser.add_argument('database', help='SQLite event database')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    counts_parser = commands.add_parser('counts', help='Print the number of detections in each time bin as CSV')
+    counts_parser.add_argument('--start', type=parse_date, required=True, help='Start of the first bin, e.g. 2015-10-08')
+    counts_parser.add_argument('--end', type=parse_date, required=True, help='End of the range (exclusive)')
+    counts_parser.add_argument('--bin', default='hour', help='Bin length: {} or a number of seconds'.format(", ".join(sorted(BIN_SIZES))))
+    counts_parser.add_argument('-z', '--zone', help='Only count this zone')
+    counts_parser.add_argument('--camera', help='Only count this camera')
+
+    import_parser = commands.add_parser('import', help='Load detections from CrowStream log files')
+    import_parser.add_argument('logs', nargs='+', help='CrowLog.log files')
+    import_parser.add_argument('--camera', default='webcam', help='Camera name to record the detections under')
+    import_parser.add_argument('--zone', default='detection_area', help='Zone name for entries without one')
+
+    args = parser.parse_args(argv)
+
+    with EventStore(args.database) as store:
+        if args.command == 'counts':
+            bin_size = BIN_SIZES.get(args.bin) or float(args.bin)
+
+            sys.stdout.write("time,zone,count\n")
+            for bin_start, zone, count in store.counts(args.start, args.end, bin_size, zone=args.zone, camera=args.camera):
+                sys.stdout.write("{},{},{}\n".format(bin_start.strftime('%Y-%m-%d %H:%M:%S'), zone, count))
+
+        else:
+            for path in args.logs:
+                with open(path) as log_file:
+                    added = store.add((timestamp, args.camera, zone, None, None)
+                                      for timestamp, zone in read_stream_log(log_file, args.zone))
+                print("{}: {} detections".format(path, added))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,442 @@
+"""
+Run several cameras in one process.
+
+Each camera gets its own capture thread (throttled to its frame rate target), background model, zones and detector
+settings. Detection for every camera runs on one shared pool of worker threads. The scheduler hands out the camera
+that has waited longest past its next due frame, with at most one frame per camera in flight, so a busy camera can't
+starve the others and no camera runs faster than its target. Health for every camera is printed every
+report interval, and served as JSON with --metrics-port.
+
+    python crow_supervisor.py cameras.json --workers 4
+
+cameras.json is a list of cameras (or {"workers": ..., "database": "events.db", "cameras": [...]}), each like
+    {"name": "front", "source": 0, "zones": "front_zones.json", "fps": 5, "threshold": 25}
+where source is a camera index, an http:// MJPEG stream or a video file, and zones is a zone list, a zone file or
+an "area": [x, y, w, h]. Any detector setting left out uses CameraStream.DEFAULTS.
+With a database, every camera's logged detections are also recorded in that crow_store event database.
+"""
+import argparse
+import datetime
+import json
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import numpy
+
+from CrowStream import get_traffic_features
+from crow_annotation import Annotation
+from crow_background import BackgroundModel
+from crow_capture import CaptureThread, Empty
+from crow_events import EventSink
+from crow_store import EventStore
+from crow_gate import MotionGate
+from crow_metrics import METRICS, start_metrics_server
+from crow_tracker import CentroidTracker
+from crow_zones import ZoneSet, get_blob_array, get_zone_blob_sizes
+
+
+def open_camera(source):
+    """
+    :param source: Camera index, http:// MJPEG stream URL or video file path
+    :return: SimpleCV camera
+    """
+    from SimpleCV import Camera, JpegStreamCamera, VirtualCamera
+
+    if isinstance(source, int):
+        return Camera(source)
+
+    if source.startswith("http://") or source.startswith("https://"):
+        return JpegStreamCamera(source)
+
+    return VirtualCamera(source, "video")
+
+
+class CameraStream(object):
+    """
+    One camera's capture thread and detector state. process() handles the next captured frame;
+    the supervisor makes sure only one worker runs it at a time, so the state needs no locking.
+    """
+
+    DEFAULTS = {
+        "fps": 5,
+        "threshold": 20,
+        "erodes": 3,
+        "dilates": 60,
+        "smooth_aperture": (19, 19),
+        "blob_min": 30,
+        "roi": False,
+        "roi_margin": None,
+        "morphology": "separable",
+        "background": "mean",
+        "window": 30,
+        "alpha": 0.05,
+        "gate": False,
+        "track": False,
+        "track_distance": 80,
+        "save_images": True,
+        "log": True,
+        "save_interval": 5,
+    }
+
+    def __init__(self, name, camera, zones, event_sink, **settings):
+        """
+        :param name: Camera name, used in logs and file names
+        :param camera: Anything with a getImage() method
+        :param zones: ZoneSet to count
+        :param event_sink: EventSink for snapshots and log lines (can be shared between cameras)
+        :param settings: Overrides for CameraStream.DEFAULTS
+        """
+        unknown = set(settings) - set(self.DEFAULTS)
+        if unknown:
+            raise ValueError("Unknown settings for camera '{}': {}".format(name, ", ".join(sorted(unknown))))
+
+        self.name = name
+        self.zones = zones
+        self.event_sink = event_sink
+        self.settings = dict(self.DEFAULTS, **settings)
+        self.settings["smooth_aperture"] = tuple(self.settings["smooth_aperture"])
+
+        self.frame_interval = 1.0 / self.settings["fps"]
+        self.capture = CaptureThread(camera, max_frames=1, policy="drop-oldest", frame_rate=self.settings["fps"])
+        self.background = BackgroundModel(window=self.settings["window"], mode=self.settings["background"],
+                                          alpha=self.settings["alpha"])
+
+        self.motion_gate = None
+        if self.settings["gate"]:
+            self.motion_gate = MotionGate()
+
+        self.tracker = None
+        if self.settings["track"]:
+            self.tracker = CentroidTracker(max_distance=self.settings["track_distance"])
+
+        # Scheduling
+        self.busy = False
+        self.next_due = time.time()
+
+        # Health
+        self.processed = 0
+        self.detections = 0
+        self.errors = 0
+        self.last_error = None
+        self.started_at = None
+        self.last_frame_time = None
+        self._frame_times = []
+        self._last_save_timestamp = datetime.datetime.min
+
+    def start(self):
+        self.started_at = time.time()
+        self.capture.start()
+
+    def stop(self):
+        self.capture.stop()
+
+    def ready(self):
+        """
+        :return: True if there is a captured frame waiting
+        """
+        return self.capture.queue_depth() > 0
+
+    def process(self):
+        """
+        Run the detector on the newest captured frame. The first `window` frames only build the background
+        """
+        try:
+            captured_at, next_image = self.capture.get(timeout=0)
+        except Empty:
+            return
+
+        settings = self.settings
+        if len(self.background) >= settings["window"] or (settings["background"] == "ema" and len(self.background)):
+            self._detect(captured_at, next_image)
+
+        self.background.append(next_image)
+
+        self.processed += 1
+        self.last_frame_time = time.time()
+        self._frame_times = [frame_time for frame_time in self._frame_times if frame_time > self.last_frame_time - 10]
+        self._frame_times.append(self.last_frame_time)
+
+    def _detect(self, captured_at, next_image):
+        settings = self.settings
+        background_image = self.background.get_image()
+
+        features = None
+        if self.motion_gate is None or self.motion_gate.has_motion(background_image, next_image):
+            features = get_traffic_features(background_image, next_image,
+                                            threshold=settings["threshold"],
+                                            erodes=settings["erodes"],
+                                            dilates=settings["dilates"],
+                                            smooth_aperture=settings["smooth_aperture"],
+                                            blob_min=settings["blob_min"],
+                                            detection_area=self.zones.bounding_box() if settings["roi"] else None,
+                                            roi_margin=settings["roi_margin"],
+                                            morphology=settings["morphology"])
+
+        blobs = get_blob_array(features)
+        zone_hits = self.zones.assign(blobs, rule="centroid")
+        annotation = Annotation(self.zones, blobs, zone_hits)
+        num_detections = annotation.detections()
+
+        if self.tracker is not None:
+            num_detections = len(self.tracker.update(blobs, zone_hits))
+
+        if not num_detections or (captured_at - self._last_save_timestamp).total_seconds() <= settings["save_interval"]:
+            return
+
+        self._last_save_timestamp = captured_at
+        self.detections += 1
+        stamp = captured_at.strftime('%Y-%m-%d %H.%M.%S')
+
+        snapshot = None
+        if settings["save_images"]:
+            snapshot = "motion {} {}.jpg".format(self.name, stamp)
+            if not self.event_sink.save_image(next_image, snapshot, annotation=annotation):
+                snapshot = None
+
+        if settings["log"]:
+            zone_counts = zone_hits.sum(axis=0)
+            log_line = stamp
+            if len(self.zones) > 1:
+                log_line += "," + ";".join(name for name, count in zip(self.zones.names, zone_counts) if count)
+
+            self.event_sink.log('{} {} CrowLog.log'.format(self.name, captured_at.strftime('%Y-%m')), log_line + "\n")
+
+            blob_sizes = get_zone_blob_sizes(blobs, zone_hits)
+            for zone in numpy.flatnonzero(zone_counts):
+                self.event_sink.record(captured_at, self.zones.names[zone], self.name, blob_sizes[zone], snapshot)
+
+    def fps(self):
+        """
+        :return: Frames processed per second over the last ten seconds
+        """
+        if len(self._frame_times) < 2 or self._frame_times[-1] == self._frame_times[0]:
+            return 0.0
+
+        return (len(self._frame_times) - 1) / (self._frame_times[-1] - self._frame_times[0])
+
+    def status(self):
+        """
+        :return: "starting", "warming up", "ok", "slow" (under half the target frame rate), "stalled" (capture
+                 thread died, or nothing processed for ten seconds or ten frame intervals, whichever is longer)
+                 or "error" (last frame failed)
+        """
+        stall_time = 10 * max(self.frame_interval, 1)
+        now = time.time()
+
+        if self.started_at is None or not self.capture.is_alive():
+            return "stalled"
+
+        if self.last_error is not None:
+            return "error"
+
+        if self.last_frame_time is None:
+            return "starting" if now - self.started_at <= stall_time else "stalled"
+
+        if now - self.last_frame_time > stall_time:
+            return "stalled"
+
+        if len(self.background) < self.settings["window"] and self.settings["background"] != "ema":
+            return "warming up"
+
+        if self.fps() < 0.5 * self.settings["fps"]:
+            return "slow"
+
+        return "ok"
+
+    def health(self):
+        """
+        :return: Dictionary describing how the camera is doing
+        """
+        return {
+            "status": self.status(),
+            "fps": round(self.fps(), 2),
+            "target_fps": self.settings["fps"],
+            "captured": self.capture.captured,
+            "dropped": self.capture.dropped,
+            "processed": self.processed,
+            "detections": self.detections,
+            "errors": self.errors,
+            "last_error": self.last_error,
+            "last_frame_age": round(time.time() - self.last_frame_time, 1) if self.last_frame_time else None,
+        }
+
+
+class Supervisor(object):
+    """
+    Schedule detection for a set of CameraStreams over a shared pool of worker threads
+    """
+
+    def __init__(self, streams, workers=2, report_interval=30):
+        """
+        :param streams: List of CameraStream
+        :param workers: Number of detection threads shared by all cameras
+        :param report_interval: Seconds between health reports (0 = off)
+        """
+        self.streams = streams
+        self.workers = workers
+        self.report_interval = report_interval
+
+        self._jobs = queue.Queue()
+        self._running = threading.Event()
+        self._threads = []
+
+    def health(self):
+        """
+        :return: Dictionary of camera name: health
+        """
+        return dict((stream.name, stream.health()) for stream in self.streams)
+
+    def report(self):
+        for stream in self.streams:
+            health = stream.health()
+            print("{}: {status}, {fps:.1f}/{target_fps} fps, {processed} frames, {dropped} dropped, "
+                  "{detections} detections, {errors} errors".format(stream.name, **health))
+
+    def run(self):
+        """
+        Start every camera and schedule frames until interrupted
+        """
+        self._running.set()
+
+        for stream in self.streams:
+            stream.start()
+
+        for _ in range(self.workers):
+            worker = threading.Thread(target=self._work)
+            worker.daemon = True
+            worker.start()
+            self._threads.append(worker)
+
+        next_report = time.time() + self.report_interval
+
+        try:
+            while True:
+                now = time.time()
+                self._schedule(now)
+
+                if self.report_interval and now >= next_report:
+                    self.report()
+                    next_report = now + self.report_interval
+
+                next_due = min(stream.next_due for stream in self.streams)
+                time.sleep(min(max(next_due - time.time(), 0.005), 0.05))
+
+        finally:
+            self.stop()
+
+    def stop(self):
+        self._running.clear()
+        for stream in self.streams:
+            stream.stop()
+
+        for _ in self._threads:
+            self._jobs.put(None)
+        for worker in self._threads:
+            worker.join()
+        self._threads = []
+
+    def _schedule(self, now):
+        """
+        Queue every camera that is due and has a frame, the most overdue first
+        """
+        for stream in sorted(self.streams, key=lambda stream: stream.next_due):
+            if stream.busy or stream.next_due > now or not stream.ready():
+                continue
+
+            stream.busy = True
+            # Keep to the frame rate target, but don't try to catch up on frames missed while overloaded
+            stream.next_due = max(stream.next_due + stream.frame_interval, now)
+            self._jobs.put(stream)
+
+    def _work(self):
+        while True:
+            stream = self._jobs.get()
+            if stream is None:
+                return
+
+            try:
+                with METRICS.time("camera_frame"):
+                    stream.process()
+                stream.last_error = None
+                METRICS.mark_frame()
+            except Exception as e:
+                stream.errors += 1
+                stream.last_error = "{}: {}".format(type(e).__name__, e)
+            finally:
+                stream.busy = False
+
+
+def load_streams(config, event_sink):
+    """
+    Build the camera streams from a supervisor config
+    :param config: List of camera dictionaries (see the module docstring)
+    :param event_sink: EventSink shared by every camera
+    :return: List of CameraStream
+    """
+    streams = []
+
+    for index, camera in enumerate(config):
+        camera = dict(camera)
+        name = camera.pop("name", "camera {}".format(index))
+        source = camera.pop("source", index)
+
+        if "zones" in camera:
+            zones = camera.pop("zones")
+            zones = ZoneSet.load(zones if isinstance(zones, list) else str(zones))  # json gives unicode paths on Python 2
+        elif "area" in camera:
+            zones = ZoneSet.from_area(camera.pop("area"))
+        else:
+            raise ValueError("Camera '{}' needs zones or an area".format(name))
+
+        streams.append(CameraStream(name, open_camera(source), zones, event_sink, **camera))
+
+    return streams
+
+
+def main(argv=None):
+    """
+    Run every camera in a config file until interrupted
+    :param argv: Command line arguments (default: sys.argv)
+    """
+    parser = argparse.ArgumentParser(description='Capture motion events from several cameras in one process')
+    parser.add_argument('config', help='JSON file listing the cameras')
+    parser.add_argument('-w', '--workers', type=int, help='Number of detection threads shared by all cameras (default: from the config, or 2)')
+    parser.add_argument('--report-interval', type=int, default=30, help='Seconds between camera health reports (0 to disable)')
+    parser.add_argument('--metrics-port', type=int, help='Serve stage timings and camera health as JSON on this local port')
+    args = parser.parse_args(argv)
+
+    with open(args.config) as config_file:
+        config = json.load(config_file)
+    if isinstance(config, list):
+        config = {"cameras": config}
+
+    event_sink = EventSink(store=EventStore(config["database"]) if config.get("database") else None)
+    streams = load_streams(config["cameras"], event_sink)
+    supervisor = Supervisor(streams, workers=args.workers or config.get("workers", 2),
+                            report_interval=args.report_interval)
+
+    if args.metrics_port:
+        METRICS.enabled = True
+        for stream in streams:
+            METRICS.register_gauge("{}.fps".format(stream.name), lambda stream=stream: round(stream.fps(), 2))
+            METRICS.register_gauge("{}.status".format(stream.name), stream.status)
+        METRICS.register_gauge("cameras", supervisor.health)
+        start_metrics_server(METRICS, args.metrics_port)
+
+    try:
+        supervisor.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        event_sink.close()
+
+    supervisor.report()
+
+
+if __name__ == '__main__':
+    main()
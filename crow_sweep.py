@@ -0,0 +1,290 @@
+"""
+Evaluate a grid of detector settings against one clip.
+
+The clip is decoded, cropped to the detection zones and smoothed once into memory-mapped frame files. The grid is
+then split into jobs for a pool of worker processes: one per threshold, erode count and blur aperture, with the
+dilation counts divided into runs so there are enough jobs to keep every process busy. A job shares its thresholded
+and eroded masks across its run of dilation counts (dilating incrementally from the previous count), and its blobs
+across every minimum blob size (blobs are found once at the smallest size and filtered for the rest).
+
+    python crow_sweep.py video.avi --area 100,200,300,80 --thresholds 15,20,25 --dilates 20,40,60 -o sweep.csv
+"""
+import argparse
+import csv
+import itertools
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+import cv2
+import numpy
+from SimpleCV import Image
+
+from crow_config import *
+from crow_frames import FFmpegFrameSource
+from crow_roi import get_roi, get_roi_margin, offset_features
+from crow_zones import ZoneSet, get_blob_array
+
+
+def decode_clip(video, folder, frame_rate=5, roi=None):
+    """
+    Decode a video once into a memory-mapped file of raw frames
+    :param video: Video path
+    :param folder: Folder for the frame file
+    :param frame_rate: Rate that frames are sampled from the video
+    :param roi: Tuple containing x, y, w, h to crop every frame to, or None for whole frames
+    :return: Read-only numpy memmap of BGR frames (frames, height, width, 3)
+    """
+    path = os.path.join(folder, "frames.raw")
+    count = 0
+    shape = None
+
+    with open(path, "wb") as frame_file:
+        for frame in FFmpegFrameSource(video, frame_rate=frame_rate).arrays():
+            if roi is not None:
+                frame = frame[roi[1]:roi[1] + roi[3], roi[0]:roi[0] + roi[2]]
+
+            frame_file.write(numpy.ascontiguousarray(frame).tostring())
+            shape = frame.shape
+            count += 1
+
+    return numpy.memmap(path, dtype=numpy.uint8, mode="r", shape=(count,) + shape)
+
+
+def prepare_diffs(frames, folder):
+    """
+    Smooth every frame once and store the grayscale difference of each consecutive pair, as get_traffic_features
+    computes it (smoothed 'before' minus smoothed 'after', saturating, then grayscale).
+    The first frame is compared with itself, like find_traffic does.
+
+    :param frames: Frames from decode_clip
+    :param folder: Folder for the difference file
+    :return: Read-only numpy memmap of differences (frames, height, width)
+    """
+    path = os.path.join(folder, "diffs.raw")
+    diffs = numpy.memmap(path, dtype=numpy.uint8, mode="w+", shape=frames.shape[:3])
+
+    last_smoothed = None
+    for index in range(len(frames)):
+        # Replicated borders, as SimpleCV's smooth() (and crow_batch.smooth_stack) use
+        smoothed = cv2.GaussianBlur(frames[index], (3, 3), 0, borderType=cv2.BORDER_REPLICATE)
+        if last_smoothed is None:
+            last_smoothed = smoothed
+
+        diffs[index] = cv2.cvtColor(cv2.subtract(last_smoothed, smoothed), cv2.COLOR_BGR2GRAY)
+        last_smoothed = smoothed
+
+    diffs.flush()
+    del diffs
+    return numpy.memmap(path, dtype=numpy.uint8, mode="r", shape=frames.shape[:3])
+
+
+class DetectionCounter(object):
+    """
+    find_traffic's counting rule: a zone fires when it holds more blobs than on the last frame,
+    at most once per cooldown
+    """
+
+    def __init__(self, zone_count, cooldown, frame_interval=0.2):
+        self.cooldown = cooldown
+        self.frame_interval = frame_interval
+        self.last_detections = numpy.zeros(zone_count, dtype=int)
+        self.last_detection_times = numpy.zeros(zone_count)
+        self.time = 0.0
+        self.detections = 0
+
+    def update(self, zone_counts):
+        for zone in numpy.flatnonzero(zone_counts > self.last_detections):
+            if self.time - self.last_detection_times[zone] > self.cooldown:
+                self.last_detection_times[zone] = self.time
+                self.detections += 1
+
+        self.last_detections = zone_counts
+        self.time += self.frame_interval
+
+
+def evaluate_group(task):
+    """
+    Worker: evaluate every setting that shares one threshold and erode count, for a run of dilation counts
+    :param task: Dictionary with the diff file details, zones, roi and the parameter lists
+    :return: List of result dictionaries
+    """
+    diffs = numpy.memmap(task["diffs_path"], dtype=numpy.uint8, mode="r", shape=task["diffs_shape"])
+    zones = task["zones"]
+    roi = task["roi"]
+    threshold = task["threshold"]
+    erodes = task["erodes"]
+    dilates = sorted(task["dilates"])
+    apertures = task["apertures"]
+    blob_mins = sorted(task["blob_mins"])
+
+    kernel = numpy.ones((3, 3), numpy.uint8)
+    counters = {}
+    for combination in itertools.product(dilates, apertures, blob_mins):
+        counters[combination] = DetectionCounter(len(zones), task["cooldown"])
+
+    for diff in diffs:
+        mask = numpy.where(diff > threshold, 255, 0).astype(numpy.uint8)
+        mask = cv2.erode(mask, kernel, iterations=erodes)
+
+        # Dilate incrementally: n + m iterations is n iterations followed by m more
+        dilated = mask
+        done = 0
+        for dilate in dilates:
+            dilated = cv2.dilate(dilated, kernel, iterations=dilate - done) if dilate > done else dilated
+            done = dilate
+
+            for aperture in apertures:
+                blurred = Image(cv2.cvtColor(dilated, cv2.COLOR_GRAY2BGR), cv2image=True).smooth(aperature=aperture)
+                features = blurred.findBlobs(minsize=blob_mins[0])
+                if roi is not None:
+                    features = offset_features(features, roi)
+
+                blobs = get_blob_array(features)
+                areas = numpy.array([blob.area() for blob in features]) if features else numpy.zeros(0)
+
+                for blob_min in blob_mins:
+                    large = areas >= blob_min
+                    zone_counts = zones.assign(blobs[large], rule="centre").sum(axis=0)
+                    counters[(dilate, aperture, blob_min)].update(zone_counts)
+
+    results = []
+    for (dilate, aperture, blob_min), counter in sorted(counters.items()):
+        results.append({
+            "threshold": threshold,
+            "erodes": erodes,
+            "dilates": dilate,
+            "smooth_aperture": "{}x{}".format(aperture[0], aperture[1]),
+            "blob_min": blob_min,
+            "detections": counter.detections,
+        })
+
+    return results
+
+
+def split_runs(values, parts):
+    """
+    Split sorted values into contiguous runs
+    :param values: List of values
+    :param parts: Number of runs wanted (fewer if there aren't enough values)
+    :return: List of lists
+    """
+    values = sorted(values)
+    parts = max(1, min(parts, len(values)))
+    return [values[len(values) * part // parts:len(values) * (part + 1) // parts] for part in range(parts)]
+
+
+def sweep(video, zones, thresholds, erodes, dilates, apertures, blob_mins, processes=None, frame_rate=5,
+          cooldown=1.5, folder=None):
+    """
+    Count detections in a clip for every combination of detector settings
+    :param video: Video path
+    :param zones: ZoneSet to count
+    :param thresholds: List of THRESHOLD_MINIMUM values
+    :param erodes: List of ERODE_ITERATIONS values
+    :param dilates: List of DILATE_ITERATIONS values
+    :param apertures: List of SMOOTHING_APERTURE values
+    :param blob_mins: List of MIN_BLOB_SIZE values
+    :param processes: Number of worker processes. Defaults to the number of CPU cores
+    :param frame_rate: Rate that frames are sampled from the video
+    :param cooldown: Minimum time between detections in seconds
+    :param folder: Folder for the frame cache. A temporary folder is used (and removed) if not given
+    :return: List of result dictionaries, one per combination
+    """
+    own_folder = folder is None
+    if own_folder:
+        folder = tempfile.mkdtemp(prefix="crow_sweep")
+
+    try:
+        width, height, duration = FFmpegFrameSource(video, frame_rate=frame_rate).probe()
+        roi = get_roi(zones.bounding_box(), (width, height), get_roi_margin(max(dilates), max(apertures), max(erodes)))
+
+        frames = decode_clip(video, folder, frame_rate, roi)
+        diffs = prepare_diffs(frames, folder)
+
+        # Split the dilation counts far enough that every process gets work. Each run dilates incrementally,
+        # so shorter runs repeat some dilation work; they are only split as much as the pool needs
+        processes = processes or multiprocessing.cpu_count()
+        group_count = len(thresholds) * len(erodes) * len(apertures)
+        dilate_runs = split_runs(dilates, -(-processes // group_count))
+
+        tasks = []
+        for threshold, erode, aperture, dilate_run in itertools.product(thresholds, erodes, apertures, dilate_runs):
+            tasks.append({
+                "diffs_path": diffs.filename,
+                "diffs_shape": diffs.shape,
+                "zones": zones,
+                "roi": roi,
+                "threshold": threshold,
+                "erodes": erode,
+                "dilates": dilate_run,
+                "apertures": [aperture],
+                "blob_mins": blob_mins,
+                "cooldown": cooldown,
+            })
+
+        pool = multiprocessing.Pool(processes)
+        try:
+            groups = pool.map(evaluate_group, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+        del frames, diffs
+        return [result for group in groups for result in group]
+
+    finally:
+        if own_folder:
+            shutil.rmtree(folder, ignore_errors=True)
+
+
+def parse_list(text, cast=int):
+    return [cast(value) for value in text.split(",")]
+
+
+def parse_apertures(text):
+    return [(int(value), int(value)) for value in text.split(",")]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Count detections in a clip for a grid of detector settings')
+    parser.add_argument('video', help='Video clip to tune against')
+    parser.add_argument('-a', '--area', help='Detection area as x,y,w,h')
+    parser.add_argument('-z', '--zones', help='JSON file of detection zones (default: DETECTION_ZONES from crow_config)')
+    parser.add_argument('--thresholds', default=str(THRESHOLD_MINIMUM), help='Comma separated threshold values')
+    parser.add_argument('--erodes', default=str(ERODE_ITERATIONS), help='Comma separated erode iteration counts')
+    parser.add_argument('--dilates', default=str(DILATE_ITERATIONS), help='Comma separated dilate iteration counts')
+    parser.add_argument('--apertures', default=str(SMOOTHING_APERTURE[0]), help='Comma separated (square) blob smoothing apertures')
+    parser.add_argument('--blob-mins', default=str(MIN_BLOB_SIZE), help='Comma separated minimum blob sizes')
+    parser.add_argument('-p', '--processes', type=int, help='Number of worker processes (default: one per CPU core)')
+    parser.add_argument('-o', '--output', help='CSV file to write the results to')
+    args = parser.parse_args()
+
+    if args.area:
+        zones = ZoneSet.from_area(parse_list(args.area))
+    elif args.zones or DETECTION_ZONES:
+        zones = ZoneSet.load(args.zones or DETECTION_ZONES)
+    else:
+        parser.error("Give a detection area (--area) or zones (--zones)")
+
+    results = sweep(args.video, zones,
+                    thresholds=parse_list(args.thresholds),
+                    erodes=parse_list(args.erodes),
+                    dilates=parse_list(args.dilates),
+                    apertures=parse_apertures(args.apertures),
+                    blob_mins=parse_list(args.blob_mins),
+                    processes=args.processes,
+                    frame_rate=FRAME_RATE,
+                    cooldown=DETECTION_COOLDOWN)
+
+    fields = ["threshold", "erodes", "dilates", "smooth_aperture", "blob_min", "detections"]
+    print("  ".join("{:>15}".format(field) for field in fields))
+    for result in results:
+        print("  ".join("{:>15}".format(result[field]) for field in fields))
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            writer = csv.DictWriter(output_file, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(results)
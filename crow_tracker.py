@@ -0,0 +1,128 @@
+import itertools
+
+import numpy
+
+from crow_zones import BLOB_CENTROID_X, BLOB_CENTROID_Y, BLOB_MIN_X, BLOB_MAX_X, BLOB_MIN_Y, BLOB_MAX_Y
+
+
+class Track(object):
+    """
+    One moving object followed across frames
+    """
+    __slots__ = ("id", "x", "y", "age", "missed", "counted")
+
+    def __init__(self, track_id, x, y):
+        self.id = track_id
+        self.x = x
+        self.y = y
+        self.age = 1
+        self.missed = 0
+        self.counted = 0  # Bit mask of the zones this track has already been counted in
+
+
+class CentroidTracker(object):
+    """
+    Follow blobs from frame to frame by their centroids and count each object once per zone it enters,
+    instead of counting rises in the number of blobs in a zone.
+
+    Blobs are matched to the nearest existing track (greedy, closest pairs first) within max_distance.
+    Unmatched blobs start new tracks; tracks unmatched for more than max_missed frames are dropped.
+    The number of blobs and tracks considered per frame is capped, so the cost per frame stays bounded
+    however busy the road gets.
+    """
+
+    def __init__(self, max_distance=80, max_missed=3, max_blobs=32, max_tracks=64):
+        """
+        :param max_distance: Furthest a centroid can move between frames and still be the same object (pixels)
+        :param max_missed: Number of frames a track survives without a matching blob
+        :param max_blobs: Only the largest this many blobs are tracked each frame
+        :param max_tracks: Most tracks kept alive at once; the oldest unmatched tracks are dropped first
+        """
+        self.max_distance = max_distance
+        self.max_missed = max_missed
+        self.max_blobs = max_blobs
+        self.max_tracks = max_tracks
+
+        self.tracks = []
+        self._ids = itertools.count(1)
+
+    def update(self, blobs, zone_hits):
+        """
+        Match this frame's blobs to the tracks and find the zone crossings
+        :param blobs: Blob array from crow_zones.get_blob_array
+        :param zone_hits: Boolean array (blobs x zones) from ZoneSet.assign
+        :return: List of (track, zone index) for every track that entered a zone for the first time
+        """
+        if len(blobs) > self.max_blobs:
+            areas = (blobs[:, BLOB_MAX_X] - blobs[:, BLOB_MIN_X]) * (blobs[:, BLOB_MAX_Y] - blobs[:, BLOB_MIN_Y])
+            keep = numpy.argsort(-areas)[:self.max_blobs]
+            blobs = blobs[keep]
+            zone_hits = zone_hits[keep]
+
+        centroids = blobs[:, [BLOB_CENTROID_X, BLOB_CENTROID_Y]]
+        matches = self._match(centroids)
+
+        matched_tracks = set()
+        crossings = []
+
+        for blob_index in range(len(centroids)):
+            track = matches.get(blob_index)
+            x, y = centroids[blob_index]
+
+            if track is None:
+                track = Track(next(self._ids), x, y)
+                self.tracks.append(track)
+            else:
+                track.x = x
+                track.y = y
+                track.age += 1
+                track.missed = 0
+
+            matched_tracks.add(track.id)
+
+            for zone in numpy.flatnonzero(zone_hits[blob_index]):
+                bit = 1 << int(zone)
+                if not track.counted & bit:
+                    track.counted |= bit
+                    crossings.append((track, int(zone)))
+
+        for track in self.tracks:
+            if track.id not in matched_tracks:
+                track.missed += 1
+
+        self.tracks = [track for track in self.tracks if track.missed <= self.max_missed]
+        if len(self.tracks) > self.max_tracks:
+            self.tracks.sort(key=lambda track: track.missed)
+            del self.tracks[self.max_tracks:]
+
+        return crossings
+
+    def _match(self, centroids):
+        """
+        :return: Dictionary of blob index: matched track
+        """
+        if not self.tracks or not len(centroids):
+            return {}
+
+        positions = numpy.array([(track.x, track.y) for track in self.tracks])
+        distances = numpy.hypot(positions[:, 0:1] - centroids[:, 0], positions[:, 1:2] - centroids[:, 1])
+
+        matches = {}
+        used_tracks = set()
+
+        # Closest pairs first; everything past max_distance is left unmatched
+        for flat_index in numpy.argsort(distances, axis=None):
+            track_index, blob_index = divmod(int(flat_index), len(centroids))
+            if distances[track_index, blob_index] > self.max_distance:
+                break
+
+            if track_index in used_tracks or blob_index in matches:
+                continue
+
+            matches[blob_index] = self.tracks[track_index]
+            used_tracks.add(track_index)
+
+            if len(used_tracks) == len(self.tracks) or len(matches) == len(centroids):
+                break
+
+        return matches
@@ -0,0 +1,132 @@
+import json
+
+import numpy
+
+# Columns of the blob array from get_blob_array
+BLOB_X, BLOB_Y, BLOB_MIN_X, BLOB_MAX_X, BLOB_MIN_Y, BLOB_MAX_Y, BLOB_CENTROID_X, BLOB_CENTROID_Y = range(8)
+
+
+def get_blob_array(features):
+    """
+    Pull the positions of every blob into one array, reading each blob's attributes exactly once
+    :param features: Feature set of blobs (may be None)
+    :return: numpy array with one row per blob: x, y, minX, maxX, minY, maxY, centroid x, centroid y
+    """
+    if not features:
+        return numpy.zeros((0, 8))
+
+    rows = []
+    for blob in features:
+        centroid = blob.centroid()
+        rows.append((blob.x, blob.y, blob.minX(), blob.maxX(), blob.minY(), blob.maxY(), centroid[0], centroid[1]))
+
+    return numpy.array(rows, dtype=float)
+
+
+class ZoneSet(object):
+    """
+    A set of named detection zones, each an x, y, w, h box, counted independently.
+    Blobs are matched against every zone at once with array operations, so extra zones cost next to nothing.
+
+    Matching rules:
+    centre   - the centre of the blob's bounding box is inside the zone (CarCrow)
+    centroid - the blob's centroid is inside the zone, or the blob covers the whole zone (CrowStream)
+    """
+
+    RULES = ("centre", "centroid")
+
+    def __init__(self, zones):
+        """
+        :param zones: List of (name, (x, y, w, h)) pairs
+        """
+        self.names = [name for name, area in zones]
+        self.areas = [tuple(area) for name, area in zones]
+
+        areas = numpy.array(self.areas, dtype=float).reshape(-1, 4)
+        self.xmin = areas[:, 0]
+        self.ymin = areas[:, 1]
+        self.xmax = self.xmin + areas[:, 2]
+        self.ymax = self.ymin + areas[:, 3]
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        return iter(zip(self.names, self.areas))
+
+    @classmethod
+    def from_area(cls, detection_area, name="detection_area"):
+        """
+        Single zone set from one bounding box
+        """
+        return cls([(name, detection_area)])
+
+    @classmethod
+    def load(cls, source):
+        """
+        Load zones from config
+        :param source: List of {"name": ..., "area": [x, y, w, h]} dictionaries, or the path of a JSON file holding one
+        :return: ZoneSet
+        """
+        if isinstance(source, str):
+            with open(source) as zone_file:
+                source = json.load(zone_file)
+
+        return cls([(zone.get("name", "zone {}".format(index)), zone["area"]) for index, zone in enumerate(source)])
+
+    def bounding_box(self):
+        """
+        :return: Tuple containing x, y, w, h of the smallest box around every zone, or None if there are no zones
+        """
+        if not len(self):
+            return None
+
+        xmin = int(self.xmin.min())
+        ymin = int(self.ymin.min())
+        return xmin, ymin, int(self.xmax.max()) - xmin, int(self.ymax.max()) - ymin
+
+    def assign(self, blobs, rule="centre"):
+        """
+        Match every blob against every zone
+        :param blobs: Blob array from get_blob_array
+        :param rule: One of ZoneSet.RULES
+        :return: Boolean numpy array (blobs x zones), True where the blob is in the zone
+        """
+        if rule == "centre":
+            x = blobs[:, BLOB_X:BLOB_X + 1]
+            y = blobs[:, BLOB_Y:BLOB_Y + 1]
+            return (self.xmin <= x) & (x <= self.xmax) & (self.ymin <= y) & (y <= self.ymax)
+
+        elif rule == "centroid":
+            # Blob will be detected if the movement covers the zone
+            covers = ((blobs[:, BLOB_MIN_X:BLOB_MIN_X + 1] <= self.xmin) & (blobs[:, BLOB_MAX_X:BLOB_MAX_X + 1] >= self.xmax) &
+                      (blobs[:, BLOB_MIN_Y:BLOB_MIN_Y + 1] <= self.ymin) & (blobs[:, BLOB_MAX_Y:BLOB_MAX_Y + 1] >= self.ymax))
+
+            # ...or at least 50% of the blob is inside the zone
+            cx = blobs[:, BLOB_CENTROID_X:BLOB_CENTROID_X + 1]
+            cy = blobs[:, BLOB_CENTROID_Y:BLOB_CENTROID_Y + 1]
+            inside = (self.xmin <= cx) & (cx <= self.xmax) & (self.ymin <= cy) & (cy <= self.ymax)
+
+            return covers | inside
+
+        raise ValueError("Unknown zone rule '{}'. Use one of: {}".format(rule, ", ".join(self.RULES)))
+
+    def count(self, blobs, rule="centre"):
+        """
+        :return: numpy array with the number of blobs in each zone
+        """
+        return self.assign(blobs, rule).sum(axis=0)
+
+
+def get_zone_blob_sizes(blobs, zone_hits):
+    """
+    Size of the biggest blob in each zone
+    :param blobs: Blob array from get_blob_array
+    :param zone_hits: Boolean array (blobs x zones) from ZoneSet.assign
+    :return: numpy array with the bounding box area (pixels) of the largest blob in each zone, 0 if it is empty
+    """
+    if not len(blobs):
+        return numpy.zeros(zone_hits.shape[1], dtype=int)
+
+    areas = (blobs[:, BLOB_MAX_X] - blobs[:, BLOB_MIN_X]) * (blobs[:, BLOB_MAX_Y] - blobs[:, BLOB_MIN_Y])
+    return numpy.where(zone_hits, areas[:, None], 0).max(axis=0).astype(int)
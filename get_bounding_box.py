@@ -1,6 +1,4 @@
-from time import sleep
-
-from SimpleCV import *
+from SimpleCV import Color, Display, Image
 
 
 def get_bounding_box(image):
@@ -23,15 +21,15 @@ def get_bounding_box(image):
         # Start of bounding box
         if disp.leftButtonDown:
             up = None
-            dwn = disp.leftButtonDownPosition()
+            down = disp.leftButtonDownPosition()
 
         # End of bounding box
         if disp.leftButtonUp:
             up = disp.leftButtonUpPosition()
 
         # If the box has been defined, draw it
-        if up is not None and dwn is not None:
-            bb = disp.pointsToBoundingBox(up, dwn)
+        if up is not None and down is not None:
+            bb = disp.pointsToBoundingBox(up, down)
             image.clearLayers()
             image.drawText(text="Drag again or right click to accept", x=0, y=0, color=Color.HOTPINK, fontsize=20)
             image.drawRectangle(bb[0], bb[1], bb[2], bb[3])
@@ -41,6 +39,9 @@ def get_bounding_box(image):
         if disp.rightButtonDown:
             if bb is not None:
                 disp.done = True
+
+    disp.quit()
+
     return bb
 
 if __name__ == '__main__':